@@ -5,7 +5,8 @@ function updateBtnStatus(str) {
     let textEnteredLength = str.length;
     console.log(textEnteredLength)
     let disabled = true
-    if (textEnteredLength >= 5 && textEnteredLength <= 50) disabled = false;
+    // serverReady is set in interact.js once server.py answers
+    if (serverReady && textEnteredLength >= 5 && textEnteredLength <= 50) disabled = false;
     
     if (disabled) {
         submitBtn.setAttribute('disabled', 'disabled')
@@ -2,6 +2,33 @@ const electron = require('electron');
 const ipc = electron.ipcRenderer;
 
 var submitBtn = document.getElementById('submit');
+const serverUrl = "http://127.0.0.1:8000";
+
+// `server.py` (started in app.js) takes a while to load the models,
+// generation is only enabled once it answers `/health`
+var serverReady = false;
+
+function showMessage(src, message){
+	src.innerHTML = "";
+	var text = document.createElement("p");
+	text.textContent = message;
+	src.appendChild(text).style.cssText = 'text-align: center;';
+}
+
+function waitForServer(delay){
+	fetch(serverUrl + "/health")
+	.then(response => {
+		if(!response.ok) throw new Error("server not ready");
+		serverReady = true;
+		showMessage(document.getElementById("showImage"), "");
+		updateBtnStatus(document.getElementById('inputBox').value);
+	})
+	.catch(() => setTimeout(() => waitForServer(Math.min(delay * 2, 2000)), delay));
+}
+
+submitBtn.setAttribute('disabled', 'disabled');
+showMessage(document.getElementById("showImage"), "Loading the models....");
+waitForServer(100);
 
 submitBtn.addEventListener('click', function(){
 	// let initCommand = "cd ../../../..";
@@ -11,34 +38,42 @@ submitBtn.addEventListener('click', function(){
 	loader.setAttribute('class', 'loader')
 	src.appendChild(loader).style.cssText = 'margin-left: auto; margin-right: auto; display: block;';
 
-	let imgType = " --save_img"
-	if(document.getElementById('animFlag').value==='1') imgType = " --save_gif"
+	// generation is served by the long-lived `server.py` started in app.js
+	let request = {
+		text: document.getElementById('inputBox').value,
+		style: parseInt(document.getElementById('fontStyle').value),
+		output: "img"
+	};
 
-	let command = ("python3 generate.py --char_seq '"
-					+ document.getElementById('inputBox').value + "' --style " +
-					+ document.getElementById('fontStyle').value +
-					imgType);
-	let regexString = /results[/]gen_img.*.[gif|png]/;
+	// animation: draw the pen live while the points are being generated
+	if(document.getElementById('animFlag').value==='1'){
+		streamStrokes(request, src);
+		return;
+	}
 	let imagePath = "";
-	
-	const { exec } = require("child_process");
-	// exec(initCommand, (getter) => {if(getter) {}});
-	exec(command, (error, data, getter) => {
-		console.log(command);
-		if(error){
-			console.log("error",error.message);
-			return;
-		}
-		if(getter){
-			console.log(data);
-			return;
-		}
-		imagePath = data.match(regexString)[0];
+	let failed = false;
+
+	fetch(serverUrl + "/generate", {
+		method: "POST",
+		headers: {"Content-Type": "application/json"},
+		body: JSON.stringify(request)
+	})
+	.then(response => response.json())
+	.then(data => {
+		if(data.error) throw new Error(data.error);
+		imagePath = data.path;
+	})
+	.catch(error => {
+		console.log("error", error.message);
+		failed = true;
+		showMessage(src, "Generation failed: " + error.message);
 	});
 
 
 	(function wait() {
-		if ( imagePath !== "" ) {
+		if ( failed ) {
+			return;
+		} else if ( imagePath !== "" ) {
 			console.log("Image Path: " + imagePath);
 			src = document.getElementById("showImage");
 			src.innerHTML="";
@@ -54,3 +89,94 @@ submitBtn.addEventListener('click', function(){
 		}
 	})();
 });
+
+// Draw the offsets in `points` ([eos, dx, dy]) fitted to `canvas`.
+function drawStrokes(canvas, points){
+	let ctx = canvas.getContext("2d");
+	let xs = [], ys = [];
+	let x = 0, y = 0;
+	for(let i = 0; i < points.length; i++){
+		x += points[i][1];
+		y += points[i][2];
+		xs.push(x);
+		ys.push(y);
+	}
+	let minX = Math.min(...xs), maxX = Math.max(...xs);
+	let minY = Math.min(...ys), maxY = Math.max(...ys);
+	let pad = 20;
+	let scale = Math.min((canvas.width - 2 * pad) / Math.max(maxX - minX, 1),
+		(canvas.height - 2 * pad) / Math.max(maxY - minY, 1), 4);
+
+	ctx.clearRect(0, 0, canvas.width, canvas.height);
+	ctx.lineWidth = 3;
+	ctx.lineCap = "round";
+	ctx.lineJoin = "round";
+	ctx.beginPath();
+	let penDown = false;
+	for(let i = 0; i < points.length; i++){
+		let px = pad + (xs[i] - minX) * scale;
+		let py = pad + (maxY - ys[i]) * scale;
+		if(penDown) ctx.lineTo(px, py);
+		else ctx.moveTo(px, py);
+		// eos = 1 is the last point of a stroke
+		penDown = points[i][0] !== 1;
+	}
+	ctx.stroke();
+}
+
+// Read the newline delimited JSON chunks of `/generate_stream` and redraw
+// the canvas with every chunk.
+function streamStrokes(request, src){
+	let points = [];
+	let canvas = null;
+
+	fetch(serverUrl + "/generate_stream", {
+		method: "POST",
+		headers: {"Content-Type": "application/json"},
+		body: JSON.stringify(request)
+	})
+	.then(response => {
+		if(!response.ok) return response.json().then(data => {
+			throw new Error(data.error);
+		});
+		src.innerHTML = "";
+		canvas = document.createElement("canvas");
+		canvas.width = src.clientWidth || 800;
+		canvas.height = 250;
+		src.appendChild(canvas).style.cssText = 'width: 100%; display: block;';
+
+		let reader = response.body.getReader();
+		let decoder = new TextDecoder();
+		let buffer = "";
+		function read(){
+			return reader.read().then(({done, value}) => {
+				if(done) return;
+				buffer += decoder.decode(value, {stream: true});
+				let lines = buffer.split("\n");
+				buffer = lines.pop();
+				for(let line of lines){
+					if(!line) continue;
+					let message = JSON.parse(line);
+					if(message.error){
+						// replaces the canvas and stops reading the stream
+						console.log("error", message.error);
+						showMessage(src, "Generation failed: " + message.error);
+						return reader.cancel();
+					}
+					if(message.strokes) points.push(...message.strokes);
+					if(message.done){
+						drawStrokes(canvas, points);
+						return reader.cancel();
+					}
+				}
+				drawStrokes(canvas, points);
+				return read();
+			});
+		}
+		return read();
+	})
+	.catch(error => {
+		console.log("error", error.message);
+		showMessage(src, "Generation failed: " + error.message);
+	});
+}
@@ -1,8 +1,11 @@
 const { app, BrowserWindow, ipcMain, Menu, dialog } = require("electron");
 const path = require("path");
+const { spawn } = require("child_process");
 const customMenu = require("./GUI/menu");
 
 let mainWindow;
+let server;
+let quitting = false;
 
 const isWindows = process.platform === 'win32';
 const isMac = process.platform === "darwin";
@@ -34,9 +37,26 @@ function createWindow() {
 }
 
 app.on('ready', function(){
+  // keep the models warm in one python process for the whole session
+  server = spawn("python3", ["server.py"], { cwd: __dirname, stdio: "inherit" });
+  server.on("exit", function(code, signal) {
+    server = null;
+    if (quitting) return;
+    dialog.showErrorBox("Generation server stopped",
+      `server.py exited (${signal || "code " + code}), see the terminal ` +
+      "output. Restart the app to generate again.");
+  });
+  server.on("error", function(error) {
+    dialog.showErrorBox("Generation server failed to start", error.message);
+  });
   createWindow();
 })
 
+app.on("will-quit", function() {
+  quitting = true;
+  if (server) server.kill();
+});
+
 
 app.on("window-all-closed", function() {
 	if (process.platform !== "darwin") app.quit();
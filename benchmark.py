@@ -0,0 +1,282 @@
+"""
+Benchmarks for generation latency/throughput and training step time.
+
+Runs on CPU with randomly initialized weights, so no pretrained checkpoint
+or dataset is needed. Results are written as JSON to track regressions.
+With `--bf16` generation and training are also timed under bfloat16
+autocast.
+
+    python benchmark.py --output ./results/benchmark.json
+"""
+
+import json
+import os
+import sys
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from models.models import (HandWritingPredictionNet, HandWritingSynthesisNet,
+                           sample_from_out_dist, sample_batch_from_out_dist)
+from train import train_epoch
+from utils.model_utils import autocast
+from utils.metadata import save_metadata, model_hyperparameters
+
+
+def argparser():
+
+    parser = argparse.ArgumentParser(
+        description="Handwriting model benchmarks")
+    parser.add_argument("--output", type=str,
+                        default="./results/benchmark.json", metavar="",
+                        help="path of the JSON results")
+    parser.add_argument("--batch_sizes", type=int, nargs="+",
+                        default=[1, 4, 16], metavar="",
+                        help="generation batch sizes")
+    parser.add_argument("--text_lengths", type=int, nargs="+",
+                        default=[16, 64], metavar="",
+                        help="generation text lengths (characters)")
+    parser.add_argument("--seq_len", type=int, default=300, metavar="",
+                        help="#points for prediction generation and the "
+                             "training minibatch length")
+    parser.add_argument("--train_batch_size", type=int, default=32,
+                        metavar="", help="training minibatch size")
+    parser.add_argument("--repeats", type=int, default=3, metavar="",
+                        help="timed repetitions, the best one is kept")
+    parser.add_argument("--vocab_size", type=int, default=77, metavar="",
+                        help="synthesis vocabulary size")
+    parser.add_argument("--bf16", action="store_true",
+                        help="also benchmark bfloat16 autocast")
+    parser.add_argument("--skip_cold_start", action="store_true",
+                        help="skip the generate.py start-up benchmark")
+    parser.add_argument("--seed", type=int, default=212, metavar="",
+                        help="random seed")
+    args = parser.parse_args()
+
+    return args
+
+
+def best_time(fn, repeats):
+    """
+    Run `fn` once to warm up, then return the fastest of `repeats` runs
+    together with the value returned by that run.
+    """
+    fn()
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start_time
+        if elapsed < best:
+            best, result = elapsed, out
+    return best, result
+
+
+def bench_synthesis_generate(model, batch_sizes, text_lengths, vocab_size,
+                             repeats, device, bf16=False):
+    label = "bf16 synthesis" if bf16 else "synthesis"
+    results = []
+    for text_len in text_lengths:
+        for batch_size in batch_sizes:
+            text = torch.randint(1, vocab_size, (batch_size, text_len),
+                                 device=device).float()
+            text_mask = torch.ones(batch_size, text_len, device=device)
+
+            def run():
+                inp = torch.zeros(batch_size, 1, 3, device=device)
+                hidden, window_vector, kappa = model.init_hidden(batch_size,
+                                                                 device)
+                with autocast(bf16):
+                    _, lengths = model.generate(
+                        inp, text, text_mask, None, None, hidden,
+                        window_vector, kappa, bias=10.0, return_lengths=True)
+                return lengths
+
+            elapsed, lengths = best_time(run, repeats)
+            n_steps = int(lengths.max())
+            n_points = int(lengths.sum())
+            results.append({
+                "batch_size": batch_size,
+                "text_length": text_len,
+                "steps": n_steps,
+                "points": n_points,
+                "time_s": elapsed,
+                "step_latency_ms": elapsed / n_steps * 1e3,
+                "points_per_s": n_points / elapsed,
+            })
+            print(f"[{label}] batch {batch_size:3d} text {text_len:3d}: "
+                  f"{results[-1]['step_latency_ms']:.2f} ms/step, "
+                  f"{results[-1]['points_per_s']:.0f} points/s")
+    return results
+
+
+def bench_prediction_generate(model, seq_len, repeats, device):
+    def run():
+        inp = torch.zeros(1, 1, 3, device=device)
+        hidden = model.init_hidden(1, device)
+        return model.generate(inp, hidden, seq_len, bias=10.0)
+
+    elapsed, _ = best_time(run, repeats)
+    result = {
+        "steps": seq_len,
+        "time_s": elapsed,
+        "step_latency_ms": elapsed / seq_len * 1e3,
+        "points_per_s": seq_len / elapsed,
+    }
+    print(f"[prediction] {result['step_latency_ms']:.2f} ms/step")
+    return result
+
+
+def bench_sampler(batch_sizes, repeats, n_calls=1000):
+    results = []
+    y_hat = torch.randn(121)
+
+    def run_single():
+        for _ in range(n_calls):
+            sample_from_out_dist(y_hat, 10.0)
+
+    elapsed, _ = best_time(run_single, repeats)
+    results.append({"function": "sample_from_out_dist", "batch_size": 1,
+                    "call_us": elapsed / n_calls * 1e6})
+    for batch_size in batch_sizes:
+        y_hat_batch = torch.randn(batch_size, 121)
+        out = torch.empty(batch_size, 1, 3)
+
+        def run_batch():
+            for _ in range(n_calls):
+                sample_batch_from_out_dist(y_hat_batch, 10.0, out=out)
+
+        elapsed, _ = best_time(run_batch, repeats)
+        results.append({"function": "sample_batch_from_out_dist",
+                        "batch_size": batch_size,
+                        "call_us": elapsed / n_calls * 1e6})
+    for result in results:
+        print(f"[sampler] {result['function']} batch "
+              f"{result['batch_size']:3d}: {result['call_us']:.1f} us/call")
+    return results
+
+
+def bench_train_step(model_type, model, batch_size, seq_len, vocab_size,
+                     text_len, repeats, device, bf16=False):
+    n_batches = 2
+    n_total = batch_size * n_batches
+    inputs = torch.randn(n_total, seq_len, 3)
+    targets = torch.randn(n_total, seq_len, 3)
+    targets[:, :, 0] = (targets[:, :, 0] > 1).float()
+    mask = torch.ones(n_total, seq_len)
+    tensors = [inputs, targets, mask]
+    if model_type == "synthesis":
+        tensors += [torch.randint(1, vocab_size, (n_total, text_len)).float(),
+                    torch.ones(n_total, text_len)]
+    loader = DataLoader(TensorDataset(*tensors), batch_size=batch_size)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+
+    def run():
+        train_epoch(model, optimizer, 0, loader, device, model_type,
+                    bf16=bf16)
+
+    elapsed, _ = best_time(run, repeats)
+    result = {
+        "batch_size": batch_size,
+        "seq_len": seq_len,
+        "minibatch_s": elapsed / n_batches,
+    }
+    label = "bf16 train" if bf16 else "train"
+    print(f"[{label} {model_type}] {result['minibatch_s']:.3f} s/minibatch "
+          f"(batch {batch_size}, length {seq_len})")
+    return result
+
+
+def bench_cold_start(model, vocab_size):
+    """
+    Wall time of a full `generate.py` invocation, including interpreter
+    start-up, imports and checkpoint loading.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, "model_synthesis.pt")
+        torch.save(model.state_dict(), model_path)
+        # printable ascii from space, covers the upper case benchmark text
+        id_to_char = {i: chr(ord(" ") + i) for i in range(vocab_size)}
+        save_metadata(model_path, "synthesis",
+                      model_hyperparameters("synthesis", model), id_to_char,
+                      np.zeros(2), np.ones(2))
+        command = [sys.executable, "generate.py", "--model_path", model_path,
+                   "--save_path", tmp_dir, "--char_seq", "COLD START",
+                   "--save_img", "--seed", "1"]
+        start_time = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed = time.perf_counter() - start_time
+    print(f"[cold start] generate.py: {elapsed:.2f}s")
+    return {"generate_py_s": elapsed}
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    device = torch.device("cpu")
+
+    synthesis_model = HandWritingSynthesisNet(window_size=args.vocab_size)
+    synthesis_model.eval()
+    prediction_model = HandWritingPredictionNet()
+    prediction_model.eval()
+
+    results = {
+        "timestamp": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "num_threads": torch.get_num_threads(),
+            "machine": platform.machine(),
+        },
+        "args": vars(args),
+    }
+    results["synthesis_generate"] = bench_synthesis_generate(
+        synthesis_model, args.batch_sizes, args.text_lengths,
+        args.vocab_size, args.repeats, device)
+    results["prediction_generate"] = bench_prediction_generate(
+        prediction_model, args.seq_len, args.repeats, device)
+    results["sampler"] = bench_sampler(args.batch_sizes, args.repeats)
+    results["train_step"] = {
+        "prediction": bench_train_step(
+            "prediction", HandWritingPredictionNet(), args.train_batch_size,
+            args.seq_len, args.vocab_size, max(args.text_lengths), 1, device),
+        "synthesis": bench_train_step(
+            "synthesis", HandWritingSynthesisNet(window_size=args.vocab_size),
+            args.train_batch_size, args.seq_len, args.vocab_size,
+            max(args.text_lengths), 1, device),
+    }
+    if args.bf16:
+        results["bf16"] = {
+            "synthesis_generate": bench_synthesis_generate(
+                synthesis_model, args.batch_sizes, args.text_lengths,
+                args.vocab_size, args.repeats, device, bf16=True),
+            "train_step": {
+                "prediction": bench_train_step(
+                    "prediction", HandWritingPredictionNet(),
+                    args.train_batch_size, args.seq_len, args.vocab_size,
+                    max(args.text_lengths), 1, device, bf16=True),
+                "synthesis": bench_train_step(
+                    "synthesis",
+                    HandWritingSynthesisNet(window_size=args.vocab_size),
+                    args.train_batch_size, args.seq_len, args.vocab_size,
+                    max(args.text_lengths), 1, device, bf16=True),
+            },
+        }
+    if not args.skip_cold_start:
+        results["cold_start"] = bench_cold_start(synthesis_model,
+                                                 args.vocab_size)
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"[SAVED] Benchmark results saved at {args.output}")
@@ -0,0 +1,77 @@
+"""
+Export a trained checkpoint as a self-contained TorchScript generator.
+
+The exported file holds the weights, the full sampling loop, the
+vocabulary and the train set offset statistics, run it with `infer.py`.
+
+    python export.py --model synthesis \
+        --model_path ./pretrained/model_synthesis.pt
+"""
+
+import argparse
+import os
+from pathlib import Path
+import torch
+from utils.constants import Global
+from generate import load_model, load_vocab_and_stats
+from models.scripted import (ScriptedPredictionGenerator,
+                             ScriptedSynthesisGenerator)
+
+
+def argparser():
+
+    parser = argparse.ArgumentParser(
+        description="Export handwriting model to TorchScript")
+    parser.add_argument("--model", type=str, default="synthesis", metavar="",
+                        help="type of model")
+    parser.add_argument("--model_path", type=Path,
+                        default="./pretrained/model_synthesis.pt", metavar="",
+                        help="path to trained weights")
+    parser.add_argument("--save_path", type=Path, metavar="",
+                        help="output file, defaults to "
+                             "<model_path stem>_scripted.pt")
+    parser.add_argument("--data_path", type=str, default="./data/", metavar="",
+                        help="path to processed training data "
+                             "(only for checkpoints without metadata)")
+    args = parser.parse_args()
+
+    return args
+
+
+def scripted_path(model_path):
+    return os.path.splitext(str(model_path))[0] + "_scripted.pt"
+
+
+def export_generator(model_type, model_path, data_path, save_path=None):
+    """
+    Script the generation loop of `model_path` and save it.
+    Returns:
+        path of the saved TorchScript module
+    """
+    device = torch.device("cpu")
+    char_to_id, _, hyperparameters = load_vocab_and_stats(
+        model_type, model_path, data_path, text_req=True)
+    model = load_model(model_type, model_path, device, **hyperparameters)
+
+    if model_type == "prediction":
+        generator = ScriptedPredictionGenerator(
+            model, Global.train_mean, Global.train_std)
+    else:
+        generator = ScriptedSynthesisGenerator(
+            model, Global.train_mean, Global.train_std, char_to_id)
+    generator.eval()
+
+    scripted = torch.jit.script(generator)
+    if save_path is None:
+        save_path = scripted_path(model_path)
+    scripted.save(str(save_path))
+
+    return save_path
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+    save_path = export_generator(args.model, args.model_path, args.data_path,
+                                 args.save_path)
+    print(f"[SAVED] TorchScript generator saved at {save_path}")
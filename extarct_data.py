@@ -14,24 +14,36 @@ in the following order
                 | ...
 """
 
+import os
 import glob
-import xml.etree.ElementTree as ElementTree
+import json
 import html
+import hashlib
+import argparse
+import xml.etree.ElementTree as ElementTree
+from multiprocessing import Pool
 import numpy as np
+from numpy.lib.format import open_memmap
+from utils.data_utils import (save_packed_data, pack_sequences, PACKED_POINTS,
+                              PACKED_OFFSETS, PACKED_CHARS,
+                              PACKED_CHAR_OFFSETS)
 
+CACHE_DIR = '.extract_cache'             # per-file extraction results
+MANIFEST = 'extract_manifest.json'       # file -> cache key and sizes
 
-def get_midpoints(pts):
+
+def get_midpoints(points, stroke_starts):
     """
-    Calculate midpoint of `x` and `y` co-ordinates as the mean of max and min
-    values.
-    params : ndarray (nested) of points
-    Returns: list of mid points for x and y
+    Calculate midpoint of `x` and `y` co-ordinates of every stroke as the
+    mean of max and min values.
+    params :
+        points (ndarray)        : points of all strokes in format [eos, x, y]
+        stroke_starts (ndarray) : index of the first point of each stroke
+    Returns: ndarray of mid points (x, y), one row per stroke
     """
-    xmax, ymax = max(pts, key=lambda x: x[1])[
-        0], max(pts, key=lambda x: x[2])[1]
-    xmin, ymin = min(pts, key=lambda x: x[1])[
-        0], min(pts, key=lambda x: x[2])[1]
-    return [(xmax + xmin)/2., (ymax + ymin)/2.]
+    xy_max = np.maximum.reduceat(points[:, 1:], stroke_starts, axis=0)
+    xy_min = np.minimum.reduceat(points[:, 1:], stroke_starts, axis=0)
+    return (xy_max + xy_min) / 2.
 
 
 def change_coord_to_offsets(stroke, norm_factor=20):
@@ -58,15 +70,95 @@ def change_coord_to_offsets(stroke, norm_factor=20):
 
 
 def save_data(strokes, sents, path='./data'):
-    strokes = np.asarray(strokes)
-    np.save(path + "/strokes", strokes)
+    """
+    Save in the packed format read by HandwritingDataset: one contiguous
+    float32 points buffer and one character buffer, each with offsets.
+    """
+    save_packed_data(strokes, sents, path)
     with open(path + '/sentences.txt', 'w') as fl:
         for sent in sents:
             fl.write(sent + '\n')
-    print(f'[SAVED] saved strokes at {path + "/strokes.npy"}')
+    print(f'[SAVED] saved strokes at {path + "/" + PACKED_POINTS}')
     print(f'[SAVED] saved sentences at {path + "/sentences.txt"}')
 
 
+def parse_xml(file):
+    """
+    Stream one IAM xml file with iterparse.
+    Returns:
+        list of text lines (None if the file has no transcription),
+        ndarray of all points in format [eos, x, y] and ndarray with the
+        index of the first point of each stroke
+    """
+    textlines = []
+    coords = []
+    stroke_lens = []
+    n_transcriptions = 0
+    in_transcription = False
+    for event, elem in ElementTree.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'Transcription':
+                n_transcriptions += 1
+                in_transcription = n_transcriptions == 1
+            continue
+        if elem.tag == 'TextLine' and in_transcription:
+            textlines.append(html.unescape(elem.get('text')))
+        elif elem.tag == 'Transcription':
+            in_transcription = False
+        elif elem.tag == 'Stroke':
+            n_coords = len(coords)
+            for pt in elem.iter('Point'):
+                coords.append(pt.get('x'))
+                coords.append(pt.get('y'))
+            if len(coords) > n_coords:
+                stroke_lens.append((len(coords) - n_coords) // 2)
+            elem.clear()
+
+    points = np.zeros((len(coords) // 2, 3), dtype=np.float32)
+    points[:, 1:] = np.array(coords, dtype=np.float32).reshape(-1, 2)
+    stroke_ends = np.cumsum(stroke_lens, dtype=np.int64)
+    points[stroke_ends - 1, 0] = 1
+    stroke_starts = stroke_ends - np.array(stroke_lens, dtype=np.int64)
+    if not n_transcriptions:
+        return None, points, stroke_starts
+    return textlines, points, stroke_starts
+
+
+def split_lines(points, stroke_starts, n_lines):
+    """
+    Segregate the strokes of a file into `n_lines` text lines, splitting
+    at the largest gaps between the midpoints of consecutive strokes.
+    Returns:
+        list of [eos, x-offset, y-offset] arrays, one per text line
+    """
+    mid_points = get_midpoints(points, stroke_starts)
+    distances = np.abs(np.diff(mid_points, axis=0)).sum(axis=1)
+    splits = np.sort(np.argsort(-distances, kind='stable')[:n_lines - 1] + 1)
+
+    assert len(splits) + 1 == n_lines,\
+        f"Strokes Segregation doesn't match with textlines "\
+        f"{len(splits) + 1} != {n_lines}"
+
+    # offsets of the whole file at once, then every line starts from
+    # [0, 0, 0] as if it was converted on its own
+    line_starts = stroke_starts[splits]
+    offsets = change_coord_to_offsets(points)
+    offsets[line_starts] = 0
+    return np.split(offsets, line_starts)
+
+
+def process_file(file):
+    """
+    Returns:
+        text lines and their offset sequences, or None for files without
+        transcription
+    """
+    textlines, points, stroke_starts = parse_xml(file)
+    if not textlines:
+        return None
+    return textlines, split_lines(points, stroke_starts, len(textlines))
+
+
 def extract_data(path='./data/original-xml-part/'):
     """
         - Reads text lines and corresponding x,y coordinates from the xml files
@@ -74,57 +166,15 @@ def extract_data(path='./data/original-xml-part/'):
         - Calculates offsets from coordinates
         - Returns sentences and corresponding stroke arrray (eos, x, y)
     """
-    files_paths = glob.glob(path + '**/*.xml', recursive=True)
-    file_no = 0
+    files_paths = sorted(glob.glob(path + '**/*.xml', recursive=True))
     sentences_all = []
     strokes_all = []
-    for file in files_paths:
-        file_no += 1
-        xml = ElementTree.parse(file).getroot()
-        transcription = xml.findall('Transcription')
-        if not transcription:
+    for file_no, file in enumerate(files_paths, 1):
+        result = process_file(file)
+        if result is None:
             print(f'[INFO] Skipped file {file}')
             continue
-        textslines = [html.unescape(tl.get('text'))
-                      for tl in transcription[0].findall('TextLine')]
-        points_set = [strk.findall('Point')
-                      for strk in xml.findall('StrokeSet/Stroke')]
-        parsed_points_set = []
-        mid_points = []
-        for points in points_set:
-            parsed_points = [[0, int(pt.get('x')), int(pt.get('y'))]
-                             for pt in points]
-            parsed_points[-1][0] = 1
-            parsed_points_set.append(parsed_points)
-            mid_points.append(get_midpoints(parsed_points))
-
-        distances = [-(abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]))
-                     for p1, p2 in zip(mid_points, mid_points[1:])]
-        splits = sorted(np.argsort(distances)[:len(textslines) - 1] + 1)
-
-        strokes_wrt_textlines = []
-        for strt_idx, end_idx in zip([0] + splits,
-                                     splits + [len(parsed_points_set)]):
-            strokes_wrt_textlines.append(parsed_points_set[strt_idx: end_idx])
-        # list of (eos,x,y) makes stroke, list of strokes make sentence,
-        # list of sentence make total textlines in the file
-        # i.e; strokes_wrt_texlines.
-
-        assert len(strokes_wrt_textlines) == len(textslines),\
-            f"Strokes Segregation doesn't match with textlines "\
-            f"{len(strokes_wrt_textlines)} != {len(textslines)}"
-
-        # We want list of (eos, x, y) wrt textlines,
-        # hence unravel list of strokes
-        textlines_seq = []
-        for line in strokes_wrt_textlines:
-            indiv_line_seq = []
-            for strokes in line:
-                indiv_line_seq += strokes
-            indiv_line_seq = np.asarray(indiv_line_seq, dtype=np.float32)
-            indiv_line_seq = change_coord_to_offsets(indiv_line_seq)
-            textlines_seq.append(indiv_line_seq)
-
+        textslines, textlines_seq = result
         strokes_all.extend(textlines_seq)
         sentences_all.extend(textslines)
         print(f'[{file_no:4d}] File: {file} -- '
@@ -135,6 +185,145 @@ def extract_data(path='./data/original-xml-part/'):
     return strokes_all, sentences_all
 
 
+def file_key(file):
+    """
+    Cache key of a file, changes whenever the file is modified.
+    """
+    stat = os.stat(file)
+    key = f'{os.path.abspath(file)}:{stat.st_mtime_ns}:{stat.st_size}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def extract_file_to_cache(job):
+    """
+    Worker: process one xml file and store its lines as a packed .npz in
+    the cache directory.
+    Returns:
+        manifest entry with the number of lines, points and characters
+    """
+    file, key, cache_dir = job
+    result = process_file(file)
+    entry = {'key': key, 'n_lines': 0, 'n_points': 0, 'n_chars': 0}
+    if result is None:
+        return file, entry
+    textlines, textlines_seq = result
+    points, offsets = pack_sequences(textlines_seq, np.float32)
+    chars, char_offsets = pack_sequences(
+        [np.array(list(line), dtype='<U1') for line in textlines], '<U1')
+    np.savez(os.path.join(cache_dir, key + '.npz'), points=points,
+             offsets=offsets, chars=chars, char_offsets=char_offsets)
+    entry.update(n_lines=len(textlines), n_points=int(points.shape[0]),
+                 n_chars=int(chars.shape[0]))
+    return file, entry
+
+
+def write_packed_from_cache(files_paths, manifest, cache_dir, path):
+    """
+    Stream the cached per-file results, in `files_paths` order, into the
+    packed output. Only one file is held in memory at a time.
+    """
+    entries = [manifest[file] for file in files_paths
+               if manifest[file]['n_lines']]
+    n_total = sum(entry['n_lines'] for entry in entries)
+    n_points = sum(entry['n_points'] for entry in entries)
+    n_chars = sum(entry['n_chars'] for entry in entries)
+
+    points = open_memmap(os.path.join(path, PACKED_POINTS), mode='w+',
+                         dtype=np.float32, shape=(n_points, 3))
+    chars = open_memmap(os.path.join(path, PACKED_CHARS), mode='w+',
+                        dtype='<U1', shape=(n_chars,))
+    offsets = np.zeros(n_total + 1, dtype=np.int64)
+    char_offsets = np.zeros(n_total + 1, dtype=np.int64)
+
+    line, point, char = 0, 0, 0
+    with open(os.path.join(path, 'sentences.txt'), 'w') as fl:
+        for entry in entries:
+            cached = np.load(os.path.join(cache_dir, entry['key'] + '.npz'))
+            n_lines = entry['n_lines']
+            points[point: point + entry['n_points']] = cached['points']
+            chars[char: char + entry['n_chars']] = cached['chars']
+            offsets[line + 1: line + n_lines + 1] = \
+                cached['offsets'][1:] + point
+            char_offsets[line + 1: line + n_lines + 1] = \
+                cached['char_offsets'][1:] + char
+            for start, end in zip(cached['char_offsets'][:-1],
+                                  cached['char_offsets'][1:]):
+                fl.write(''.join(cached['chars'][start:end]) + '\n')
+            line += n_lines
+            point += entry['n_points']
+            char += entry['n_chars']
+
+    points.flush()
+    chars.flush()
+    np.save(os.path.join(path, PACKED_OFFSETS), offsets)
+    np.save(os.path.join(path, PACKED_CHAR_OFFSETS), char_offsets)
+    print(f'[SAVED] saved {n_total} lines ({n_points} points) at '
+          f'{os.path.join(path, PACKED_POINTS)}')
+
+
+def extract_data_parallel(path='./data/original-xml-part/', out_path='./data',
+                          n_workers=None):
+    """
+    Parallel, incremental version of `extract_data` + `save_data`.
+
+    Files are processed by a pool of workers, each writing its result to
+    a per-file cache keyed by path, mtime and size. Files whose key is
+    unchanged since the last run are skipped, then all cached results are
+    streamed into the packed output.
+    """
+    files_paths = sorted(glob.glob(path + '**/*.xml', recursive=True))
+    cache_dir = os.path.join(out_path, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(out_path, MANIFEST)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as fl:
+            manifest = json.load(fl)
+
+    jobs = []
+    for file in files_paths:
+        key = file_key(file)
+        entry = manifest.get(file)
+        cached = entry is not None and entry['key'] == key and (
+            not entry['n_lines'] or
+            os.path.isfile(os.path.join(cache_dir, key + '.npz')))
+        if not cached:
+            jobs.append((file, key, cache_dir))
+    print(f'[INFO] {len(files_paths)} files, {len(jobs)} to (re)process')
+
+    with Pool(n_workers) as pool:
+        for file_no, (file, entry) in enumerate(
+                pool.imap_unordered(extract_file_to_cache, jobs,
+                                    chunksize=8), 1):
+            old_entry = manifest.get(file)
+            if old_entry is not None and old_entry['key'] != entry['key']:
+                stale = os.path.join(cache_dir, old_entry['key'] + '.npz')
+                if os.path.isfile(stale):
+                    os.remove(stale)
+            manifest[file] = entry
+            if entry['n_lines']:
+                print(f'[{file_no:4d}] File: {file} -- '
+                      f'TextLines: {entry["n_lines"]}')
+            else:
+                print(f'[INFO] Skipped file {file}')
+
+    manifest = {file: manifest[file] for file in files_paths}
+    with open(manifest_path, 'w') as fl:
+        json.dump(manifest, fl)
+
+    write_packed_from_cache(files_paths, manifest, cache_dir, out_path)
+
+
 if __name__ == "__main__":
-    strokes, sents = extract_data()
-    save_data(strokes, sents)
+    parser = argparse.ArgumentParser(
+        description="Extract IAM On-Line handwriting data")
+    parser.add_argument("--path", type=str,
+                        default="./data/original-xml-part/", metavar="",
+                        help="path to the IAM xml files")
+    parser.add_argument("--out_path", type=str, default="./data", metavar="",
+                        help="output path of the packed data")
+    parser.add_argument("--n_workers", type=int, metavar="",
+                        help="#worker processes, defaults to #cpus")
+    args = parser.parse_args()
+
+    extract_data_parallel(args.path, args.out_path, args.n_workers)
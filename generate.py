@@ -1,15 +1,23 @@
-import json
-import codecs
 import torch
 import time
 import numpy as np
 import argparse
 import os
+import textwrap
+import pickle
 from pathlib import Path
-from utils import plot_stroke, plot_stroke_gif
+from utils import plot_stroke_gif
+from utils.render import (RENDERERS, save_image, save_animation,
+                          stroke_to_svg)
 from utils.constants import Global
 from utils.dataset import HandwritingDataset
 from utils.data_utils import data_denormalization, data_normalization
+from utils.metadata import load_metadata, vocab_from_metadata
+from utils.model_utils import (quantize_model, is_quantized_state_dict,
+                               checkpoint_digest, autocast)
+from utils.style_cache import StyleCache, style_cache_dir
+from utils.result_cache import ResultCache
+from utils.stroke_io import EXPORT_FORMATS, save_strokes
 from models.models import HandWritingPredictionNet, HandWritingSynthesisNet
 
 
@@ -35,27 +43,251 @@ def argparser():
                         help="flag indicating to fetch text data also")
     parser.add_argument("--seed", type=int, metavar="", help="random seed")
     parser.add_argument("--data_path", type=str, default="./data/", metavar="",
-                        help="path to processed training data")
+                        help="path to processed training data "
+                             "(only for checkpoints without metadata)")
     parser.add_argument("--style", type=int, metavar="",
                         help="style number [0,4]")
+    parser.add_argument("--quantize", action="store_true",
+                        help="dynamic int8 quantization for CPU inference")
+    parser.add_argument("--bf16", action="store_true",
+                        help="bfloat16 autocast for CPU inference")
+    parser.add_argument("--no_style_cache", action="store_true",
+                        help="prime the style from scratch, without reading "
+                             "or writing the primed style cache")
+    parser.add_argument("--result_cache", type=str, metavar="",
+                        help="directory caching seeded generations")
+    parser.add_argument("--result_cache_size", type=int, default=256,
+                        metavar="", help="result cache size in MB")
+    parser.add_argument("--document", action="store_true",
+                        help="word wrap --char_seq into a page of lines")
+    parser.add_argument("--text_file", type=str, metavar="",
+                        help="text file to write as a page (implies "
+                             "--document)")
+    parser.add_argument("--line_width", type=int, default=50, metavar="",
+                        help="max characters per line in document mode")
+    parser.add_argument("--batch_lines", type=int, default=8, metavar="",
+                        help="lines generated together in document mode")
+    parser.add_argument("--line_spacing", type=float, default=2.0,
+                        metavar="", help="baseline distance in line heights "
+                                         "in document mode")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--save_img", action="store_true",
                        help="save output as .png")
     group.add_argument("--save_gif", action="store_true",
                        help="save output as .gif")
+    group.add_argument("--save_svg", action="store_true",
+                       help="save output as .svg")
+    group.add_argument("--save_apng", action="store_true",
+                       help="save output as animated .png")
+    group.add_argument("--save_animated_svg", action="store_true",
+                       help="save output as animated .svg")
+    parser.add_argument("--renderer", type=str, default="pillow",
+                        choices=RENDERERS, metavar="",
+                        help="png/gif renderer: pillow (fast) or matplotlib")
+    parser.add_argument("--export", type=str, default="json",
+                        choices=EXPORT_FORMATS, metavar="",
+                        help="format of the exported sequence: json, npy "
+                             "(float32), npy16 (float16), int16 (quantized "
+                             "binary) or none")
+    parser.add_argument("--fps", type=int, default=20, metavar="",
+                        help="frames per second of animations")
+    parser.add_argument("--points_per_frame", type=int, default=5,
+                        metavar="", help="points drawn per animation frame")
     args = parser.parse_args()
+    if (args.document or args.text_file) and args.model != "synthesis":
+        parser.error("document mode needs the synthesis model")
 
     return args
 
 
+def load_model(model_type, model_path, device, quantize=False,
+               **model_kwargs):
+    """
+    Build the requested network and load its trained weights.
+    `model_kwargs` are the constructor hyperparameters (e.g. `window_size`
+    for the synthesis model), as stored in the checkpoint metadata.
+    With `quantize` the LSTM and Linear layers are dynamically quantized to
+    int8 for CPU inference, both float and already quantized checkpoints
+    (saved by `quantize.py`) can be loaded.
+    """
+    if model_type == "prediction":
+        model = HandWritingPredictionNet(**model_kwargs)
+    elif model_type == "synthesis":
+        model = HandWritingSynthesisNet(**model_kwargs)
+    else:
+        raise ValueError(f"Unknown model type: {model_type}")
+
+    if not quantize:
+        # load the best model
+        model.load_state_dict(torch.load(model_path, map_location=device))
+        model = model.to(device)
+        model.eval()
+        return model
+
+    if device.type != "cpu":
+        raise ValueError("Quantized inference is only supported on CPU")
+    try:
+        state_dict = torch.load(model_path, map_location=device)
+    except pickle.UnpicklingError:
+        # newer torch versions only unpickle plain tensors by default,
+        # quantized checkpoints hold packed params
+        state_dict = torch.load(model_path, map_location=device,
+                                weights_only=False)
+    if is_quantized_state_dict(state_dict):
+        model = quantize_model(model)
+        model.load_state_dict(state_dict)
+    else:
+        model.load_state_dict(state_dict)
+        model = quantize_model(model)
+    model.eval()
+
+    return model
+
+
+def load_vocab_and_stats(model_type, model_path, data_path, text_req=False):
+    """
+    Vocabulary and train set mean/std (stored in Global) for `model_path`.
+    Uses the metadata saved next to the checkpoint, checkpoints without it
+    fall back to rebuilding the training dataset.
+    Returns:
+        char_to_id, idx_to_char and the model hyperparameters
+    """
+    try:
+        metadata = load_metadata(model_path)
+    except FileNotFoundError:
+        print("[INFO] No metadata found for checkpoint, "
+              "rebuilding training dataset.")
+        train_dataset = HandwritingDataset(data_path, split="train",
+                                           text_req=text_req)
+        hyperparameters = {}
+        if model_type == "synthesis":
+            hyperparameters["window_size"] = train_dataset.vocab_size
+        return train_dataset.char_to_id, train_dataset.idx_to_char, \
+            hyperparameters
+
+    Global.train_mean = metadata["train_mean"]
+    Global.train_std = metadata["train_std"]
+    char_to_id, idx_to_char = vocab_from_metadata(metadata)
+
+    return char_to_id, idx_to_char, metadata["hyperparameters"]
+
+
+def load_style(styles, texts, style_idx, device):
+    """
+    Normalize the priming strokes of style `style_idx`.
+    Works on a copy so `styles` can be reused across requests.
+    """
+    real_text = texts[style_idx]
+    style = np.array(styles[style_idx], dtype=np.float32)
+    mean, std, _ = data_normalization(style)
+    style = np.expand_dims(style, axis=0)
+    style = torch.from_numpy(style).to(device)
+
+    return style, real_text
+
+
+def model_digest(model_path, quantize=False, bf16=False):
+    """
+    Identifies the weights in caches, quantized weights and bfloat16
+    autocast give slightly different outputs so they get their own entries.
+    """
+    return checkpoint_digest(model_path) + ("-int8" if quantize else "") + \
+        ("-bf16" if bf16 else "")
+
+
+def load_style_cache(model_path, quantize=False, capacity=8, on_disk=True,
+                     bf16=False):
+    """
+    Style cache stored next to `model_path`.
+    """
+    cache_dir = style_cache_dir(model_path) if on_disk else None
+    return StyleCache(model_digest(model_path, quantize, bf16), cache_dir,
+                      capacity)
+
+
+def result_key(model_type, digest, text, style, bias, seed, seq_len, device,
+               **options):
+    """
+    Result cache key of a seeded generation request, `seq_len` only
+    matters to the prediction model. Seeded sampling differs between CPU
+    and CUDA, so the `device` type is part of the key. `options` are any
+    other settings changing the output, e.g. the document layout.
+    """
+    if model_type == "synthesis":
+        seq_len = None
+    else:
+        text = None
+    return ResultCache.key(model=model_type, checkpoint=digest, text=text,
+                           style=style, bias=float(bias), seed=int(seed),
+                           seq_len=seq_len, device=device.type, **options)
+
+
+# rendered outputs and the extension of their files
+OUTPUT_EXTENSIONS = {"img": ".png", "svg": ".svg", "gif": ".gif",
+                     "apng": ".png", "animated_svg": ".svg"}
+
+
+def output_cache_ext(output, renderer, fps, points_per_frame):
+    """
+    Result cache extension of a rendered `output`. Renderers draw
+    differently and animations differ with their timing, so they are
+    cached separately.
+    """
+    ext = OUTPUT_EXTENSIONS[output]
+    if output == "img" or (output == "gif" and renderer == "matplotlib"):
+        return "." + renderer + ext
+    if output in ("gif", "apng", "animated_svg"):
+        return f".{fps}-{points_per_frame}.anim{ext}"
+    return ext
+
+
+def render_output(gen_seq, output, path, renderer="pillow", fps=20,
+                  points_per_frame=5, result_cache=None, key=None):
+    """
+    Save the denormalized `gen_seq` as `output` (a key of
+    OUTPUT_EXTENSIONS) at `path`, copied from `result_cache` when it was
+    rendered before for the request `key`.
+    """
+    ext = output_cache_ext(output, renderer, fps, points_per_frame)
+    cached = result_cache is not None and key is not None
+    if cached and result_cache.get_file(key, ext, path) is not None:
+        return path
+
+    if output == "img":
+        save_image(gen_seq, path, renderer)
+    elif output == "svg":
+        stroke_to_svg(gen_seq, save_name=path)
+    elif output == "gif" and renderer == "matplotlib":
+        plot_stroke_gif(gen_seq, save_name=path)
+    else:
+        save_animation(gen_seq, path, fps, points_per_frame)
+    if cached and os.path.isfile(path):
+        result_cache.put_file(key, ext, path)
+    return path
+
+
+def primed_style_state(model, style_cache, styles, texts, style_idx,
+                       char_to_id, device):
+    """
+    Post-priming (hidden, cell) of the synthesis model for `style_idx`,
+    from `style_cache` when this style was primed before.
+    """
+    def compute():
+        style, real_text = load_style(styles, texts, style_idx, device)
+        prime_text, prime_mask = encode_texts([real_text], char_to_id, device)
+        hidden, window_vector, kappa = model.init_hidden(1, device)
+        return model.prime_hidden(style, prime_text, prime_mask, hidden,
+                                  window_vector, kappa)
+
+    return style_cache.get(styles[style_idx], texts[style_idx], compute,
+                           device)
+
+
 def generate_unconditional_seq(model_path, seq_len, device, bias, style,
-                               prime):
+                               prime, model=None):
 
-    model = HandWritingPredictionNet()
-    # load the best model
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model = model.to(device)
-    model.eval()
+    if model is None:
+        model = load_model("prediction", model_path, device)
 
     # initial input
     inp = torch.zeros(1, 1, 3)
@@ -71,41 +303,69 @@ def generate_unconditional_seq(model_path, seq_len, device, bias, style,
     return gen_seq
 
 
-def generate_conditional_sequence(model_path, char_seq, device, char_to_id,
-                                  idx_to_char, bias, prime, prime_seq,
-                                  real_text, batch_size=1):
+def encode_texts(char_seqs, char_to_id, device):
+    """
+    Label encode a batch of lines, zero padded to the longest one.
+    Returns:
+        text (N, U) and text_mask (N, U) tensors
+    """
+    char_lens = [len(char_seq) for char_seq in char_seqs]
+    text = np.zeros((len(char_seqs), max(char_lens)), dtype=np.float32)
+    text_mask = np.zeros(text.shape, dtype=np.float32)
+    for i, char_seq in enumerate(char_seqs):
+        text[i, :char_lens[i]] = [char_to_id[char] for char in char_seq]
+        text_mask[i, :char_lens[i]] = 1.
+    text = torch.from_numpy(text).to(device)
+    text_mask = torch.from_numpy(text_mask).to(device)
 
-    model = HandWritingSynthesisNet(window_size=len(char_to_id))
-    # load the best model
-    model.load_state_dict(torch.load(model_path, map_location=device))
+    return text, text_mask
 
-    model = model.to(device)
-    model.eval()
 
-    # initial input
+def prime_inputs(prime, prime_seq, real_text, char_to_id, batch_size,
+                 device):
+    """
+    Initial input, priming text and priming mask for the synthesis model.
+    The same priming style is shared by every row of the batch.
+    """
     if prime:
-        inp = prime_seq
-        real_seq = np.array(list(real_text))
-        idx_arr = [char_to_id[char] for char in real_seq]
-        prime_text = np.array(
-            [idx_arr for i in range(batch_size)]).astype(np.float32)
-        prime_text = torch.from_numpy(prime_text).to(device)
-        prime_mask = torch.ones(prime_text.shape).to(device)
+        inp = prime_seq.expand(batch_size, -1, -1)
+        prime_text, prime_mask = encode_texts([real_text] * batch_size,
+                                              char_to_id, device)
     else:
         prime_text = None
         prime_mask = None
         inp = torch.zeros(batch_size, 1, 3).to(device)
 
-    char_seq = np.array(list(char_seq + "  "))
-    print("".join(char_seq))
-    text = np.array(
-        [[char_to_id[char] for char in char_seq] for i in range(batch_size)]
-    ).astype(np.float32)
-    text = torch.from_numpy(text).to(device)
+    return inp, prime_text, prime_mask
+
+
+def generate_conditional_sequence(model_path, char_seq, device, char_to_id,
+                                  idx_to_char, bias, prime, prime_seq,
+                                  real_text, batch_size=1, model=None,
+                                  style_state=None):
+    """
+    `style_state` is an already primed (hidden, cell) (see
+    `primed_style_state`), generation then starts from it instead of
+    priming with `prime_seq`.
+    """
+    if model is None:
+        model = load_model("synthesis", model_path, device,
+                           window_size=len(char_to_id))
+    if style_state is not None:
+        prime = False
+
+    # initial input
+    inp, prime_text, prime_mask = prime_inputs(prime, prime_seq, real_text,
+                                               char_to_id, batch_size, device)
 
-    text_mask = torch.ones(text.shape).to(device)
+    char_seq = char_seq + "  "
+    print(char_seq)
+    text, text_mask = encode_texts([char_seq] * batch_size, char_to_id,
+                                   device)
 
     hidden, window_vector, kappa = model.init_hidden(batch_size, device)
+    if style_state is not None:
+        hidden = tuple(s.repeat(1, batch_size, 1) for s in style_state)
 
     print("Generating sequence....")
     gen_seq = model.generate(inp, text, text_mask, prime_text, prime_mask,
@@ -120,6 +380,142 @@ def generate_conditional_sequence(model_path, char_seq, device, char_to_id,
     return gen_seq
 
 
+def stream_conditional_sequence(model, char_seq, device, char_to_id, bias,
+                                prime, prime_seq, real_text, train_mean,
+                                train_std, chunk_size=10, style_state=None):
+    """
+    Generate `char_seq` like `generate_conditional_sequence`, yielding the
+    points as soon as they are sampled, in chunks of `chunk_size`.
+    Yields:
+        (n, 3) ndarrays denormalized with `train_mean` and `train_std`
+    """
+    if style_state is not None:
+        prime = False
+    inp, prime_text, prime_mask = prime_inputs(prime, prime_seq, real_text,
+                                               char_to_id, 1, device)
+    text, text_mask = encode_texts([char_seq + "  "], char_to_id, device)
+    hidden, window_vector, kappa = model.init_hidden(1, device)
+    if style_state is not None:
+        hidden = style_state
+
+    chunk = []
+    for _, points, _ in model.generate_steps(inp, text, text_mask,
+                                             prime_text, prime_mask, hidden,
+                                             window_vector, kappa, bias,
+                                             prime=prime):
+        chunk.append(points)
+        if len(chunk) == chunk_size:
+            yield data_denormalization(
+                train_mean, train_std,
+                torch.stack(chunk, dim=1).cpu().numpy())[0]
+            chunk = []
+    if chunk:
+        yield data_denormalization(
+            train_mean, train_std, torch.stack(chunk, dim=1).cpu().numpy())[0]
+
+
+def generate_conditional_batch(model_path, char_seqs, device, char_to_id,
+                               bias, prime, prime_seq, real_text, model=None,
+                               style_state=None):
+    """
+    Generate several text lines of different lengths in one batched
+    sampling loop, optionally from a primed `style_state`.
+    Returns:
+        list of (seq_len, 3) arrays, one per line of `char_seqs`
+    """
+    if model is None:
+        model = load_model("synthesis", model_path, device,
+                           window_size=len(char_to_id))
+    if style_state is not None:
+        prime = False
+
+    batch_size = len(char_seqs)
+    inp, prime_text, prime_mask = prime_inputs(prime, prime_seq, real_text,
+                                               char_to_id, batch_size, device)
+    text, text_mask = encode_texts([char_seq + "  " for char_seq in char_seqs],
+                                   char_to_id, device)
+
+    hidden, window_vector, kappa = model.init_hidden(batch_size, device)
+    if style_state is not None:
+        hidden = tuple(s.repeat(1, batch_size, 1) for s in style_state)
+
+    print(f"Generating {batch_size} sequences....")
+    gen_seq, lengths = model.generate(inp, text, text_mask, prime_text,
+                                      prime_mask, hidden, window_vector,
+                                      kappa, bias, prime=prime,
+                                      return_lengths=True)
+
+    return [gen_seq[i, :lengths[i]] for i in range(batch_size)]
+
+
+def wrap_text(text, line_width):
+    """
+    Word wrap `text` into lines of at most `line_width` characters, the
+    model is trained on single text lines. Blank lines of `text` are kept
+    as empty lines between paragraphs.
+    """
+    lines = []
+    for paragraph in text.splitlines():
+        lines.extend(textwrap.wrap(paragraph, line_width) or [""])
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def generate_document(model_path, lines, device, char_to_id, bias, prime,
+                      prime_seq, real_text, batch_size=8, model=None,
+                      style_state=None):
+    """
+    Generate the non empty `lines` of a document, `batch_size` lines at a
+    time, all with the same priming style.
+    Returns:
+        list of (seq_len, 3) arrays, None for the empty lines
+    """
+    text_lines = [line for line in lines if line]
+    gen_lines = []
+    for i in range(0, len(text_lines), batch_size):
+        gen_lines.extend(generate_conditional_batch(
+            model_path, text_lines[i:i + batch_size], device, char_to_id,
+            bias, prime, prime_seq, real_text, model=model,
+            style_state=style_state))
+
+    gen_lines = iter(gen_lines)
+    return [next(gen_lines) if line else None for line in lines]
+
+
+def layout_page(line_seqs, line_spacing=2.0):
+    """
+    Lay denormalized lines out on one page. Lines are left aligned and
+    each baseline (median height of the line) is `line_spacing` median line
+    heights below the previous one, None lines leave an empty line.
+    Returns:
+        (seq_len, 3) offsets of the whole page
+    """
+    coords = [None if seq is None or not len(seq) else
+              np.cumsum(seq[:, 1:], axis=0) for seq in line_seqs]
+    heights = [np.percentile(xy[:, 1], 95) - np.percentile(xy[:, 1], 5)
+               for xy in coords if xy is not None]
+    spacing = line_spacing * (np.median(heights) if heights else 1.0)
+
+    page = []
+    for i, (seq, xy) in enumerate(zip(line_seqs, coords)):
+        if xy is None:
+            continue
+        line = np.empty((len(seq), 3), dtype=np.float32)
+        line[:, 0] = seq[:, 0]
+        # lift the pen before moving to the next line
+        line[-1, 0] = 1
+        line[:, 1] = xy[:, 0] - xy[:, 0].min()
+        line[:, 2] = xy[:, 1] - np.median(xy[:, 1]) - i * spacing
+        page.append(line)
+    if not page:
+        return np.zeros((0, 3), dtype=np.float32)
+
+    page = np.concatenate(page)
+    page[1:, 1:] = np.diff(page[:, 1:], axis=0)
+    return page
+
+
 if __name__ == "__main__":
 
     args = argparser()
@@ -131,65 +527,120 @@ if __name__ == "__main__":
         torch.manual_seed(args.seed)
         np.random.seed(args.seed)
 
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    device = torch.device("cuda:0" if torch.cuda.is_available() and
+                          not (args.quantize or args.bf16) else "cpu")
 
     model_path = args.model_path
     model = args.model
     prime = True if args.style is not None else False
 
-    train_dataset = HandwritingDataset(
-        args.data_path, split="train", text_req=args.text_req
-    )
-
-    if args.style is not None:
-        styles = np.load('./styles/style_strokes.npy', allow_pickle=True)
-        texts = np.load('./styles/style_sents.npy', allow_pickle=True)
-        real_text = texts[args.style]
-        style = styles[args.style]
-        mean, std, _ = data_normalization(style)
-        style = np.expand_dims(style, axis=0)
-        style = torch.from_numpy(style).to(device)
-        ytext = real_text + " " + args.char_seq + "  "
-
-    else:
-        idx = -1
-        real_text = ""
-        style = None
-        ytext = args.char_seq + "  "
-
-    if model == "prediction":
-        gen_seq = generate_unconditional_seq(model_path, args.seq_len, device,
-                                             args.bias, style=style,
-                                             prime=prime)
-    elif model == "synthesis":
-        gen_seq = generate_conditional_sequence(model_path, args.char_seq,
-                                                device,
-                                                train_dataset.char_to_id,
-                                                train_dataset.idx_to_char,
-                                                args.bias, prime,
-                                                style, real_text)
-
-    gen_seq = data_denormalization(
-        Global.train_mean, Global.train_std, gen_seq)
-    gen_seq = np.squeeze(gen_seq)
+    lines, options = None, {}
+    if args.document or args.text_file:
+        text = args.char_seq
+        if args.text_file:
+            with open(args.text_file) as file:
+                text = file.read()
+        lines = wrap_text(text, args.line_width)
+        options = {"lines": lines, "batch_lines": args.batch_lines,
+                   "line_spacing": args.line_spacing}
+
+    # seeded requests are deterministic, reuse their cached results
+    result_cache, key, gen_seq = None, None, None
+    if args.result_cache and args.seed:
+        result_cache = ResultCache(args.result_cache,
+                                   args.result_cache_size * 2**20)
+        key = result_key(model,
+                         model_digest(model_path, args.quantize, args.bf16),
+                         args.char_seq, args.style, args.bias, args.seed,
+                         args.seq_len, device, **options)
+        gen_seq = result_cache.get_strokes(key)
+        if gen_seq is not None:
+            print("[INFO] Loaded generated sequence from result cache")
+
+    if gen_seq is None:
+        char_to_id, idx_to_char, hyperparameters = load_vocab_and_stats(
+            model, model_path, args.data_path, text_req=args.text_req)
+        net = load_model(model, model_path, device, quantize=args.quantize,
+                         **hyperparameters)
+
+        with autocast(args.bf16):
+            style_state = None
+            if args.style is not None:
+                styles = np.load('./styles/style_strokes.npy',
+                                 allow_pickle=True)
+                texts = np.load('./styles/style_sents.npy',
+                                allow_pickle=True)
+                style, real_text = load_style(styles, texts, args.style,
+                                              device)
+                ytext = real_text + " " + args.char_seq + "  "
+                if model == "synthesis" and not args.no_style_cache:
+                    style_cache = load_style_cache(
+                        model_path, args.quantize, bf16=args.bf16)
+                    style_state = primed_style_state(
+                        net, style_cache, styles, texts, args.style,
+                        char_to_id, device)
+
+            else:
+                idx = -1
+                real_text = ""
+                style = None
+                ytext = args.char_seq + "  "
+
+            if lines is not None:
+                start_time = time.time()
+                gen_lines = generate_document(
+                    model_path, lines, device, char_to_id, args.bias, prime,
+                    style, real_text, args.batch_lines, model=net,
+                    style_state=style_state)
+                print(f"Generated {len(lines)} lines in "
+                      f"{time.time() - start_time:.2f}s")
+                gen_lines = [None if seq is None else data_denormalization(
+                    Global.train_mean, Global.train_std, seq[None])[0]
+                    for seq in gen_lines]
+                # lines are laid out on the page in denormalized coordinates
+                gen_seq = layout_page(gen_lines, args.line_spacing)
+            elif model == "prediction":
+                gen_seq = generate_unconditional_seq(
+                    model_path, args.seq_len, device, args.bias, style=style,
+                    prime=prime, model=net)
+            elif model == "synthesis":
+                gen_seq = generate_conditional_sequence(
+                    model_path, args.char_seq, device, char_to_id,
+                    idx_to_char, args.bias, prime, style, real_text,
+                    model=net, style_state=style_state)
+
+        if lines is None:
+            gen_seq = data_denormalization(
+                Global.train_mean, Global.train_std, gen_seq)
+            gen_seq = np.squeeze(gen_seq)
+        if result_cache is not None:
+            result_cache.put_strokes(key, gen_seq)
 
     # plot the sequence
     if args.save_img:
-        img_path = os.path.join(str(args.save_path),
-                                "gen_img"+str(time.time())+".png")
-        plot_stroke(gen_seq, save_name=img_path)
-        print(f"Image saved as: {img_path}")
-
-    if args.save_gif:
-        gif_path = os.path.join(str(args.save_path),
-                                "gen_img"+str(time.time())+".gif")
-        plot_stroke_gif(gen_seq, save_name=gif_path)
-        print(f"GIF saved as: {gif_path}")
-
-    # Export generated sequence as json
-    seq_list = gen_seq.tolist()
-    json_file_path = os.path.join(str(args.save_path), "generated_seq.json")
-    json.dump(seq_list,
-              codecs.open(json_file_path, 'w', encoding='utf-8'),
-              separators=(',', ':'), sort_keys=True, indent=4)
-    print(f"Sequence saved to json: {json_file_path}")
+        output, name = "img", "gen_img"
+    elif args.save_svg:
+        output, name = "svg", "gen_img"
+    elif args.save_gif:
+        output, name = "gif", "gen_img" if args.renderer == "matplotlib" \
+            else "gen_anim"
+    elif args.save_apng:
+        output, name = "apng", "gen_anim"
+    else:
+        output, name = "animated_svg", "gen_anim"
+    out_path = os.path.join(str(args.save_path), name + str(time.time()) +
+                            OUTPUT_EXTENSIONS[output])
+    render_output(gen_seq, output, out_path, args.renderer, args.fps,
+                  args.points_per_frame, result_cache, key)
+    label = {"img": "Image", "svg": "SVG", "gif": "GIF"}.get(output,
+                                                             "Animation")
+    print(f"{label} saved as: {out_path}")
+
+    if result_cache is not None:
+        print(f"[INFO] Result cache: {result_cache.stats()}")
+
+    # Export generated sequence
+    seq_path = save_strokes(gen_seq, os.path.join(
+        str(args.save_path), "gen_seq" + str(time.time())), args.export)
+    if seq_path is not None:
+        print(f"Sequence saved as: {seq_path}")
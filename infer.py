@@ -0,0 +1,112 @@
+"""
+Lean inference with a generator exported by `export.py`.
+
+Only torch and numpy are imported, neither the model code, the dataset
+utilities nor matplotlib are needed.
+
+    python infer.py --scripted_path ./pretrained/model_synthesis_scripted.pt \
+        --char_seq "hello world" --style 1
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+import numpy as np
+import torch
+
+
+def argparser():
+
+    parser = argparse.ArgumentParser(
+        description="Run an exported handwriting generator")
+    parser.add_argument("--scripted_path", type=Path,
+                        default="./pretrained/model_synthesis_scripted.pt",
+                        metavar="", help="path to exported generator")
+    parser.add_argument("--save_path", type=Path, default="./results/",
+                        metavar="", help="output path")
+    parser.add_argument("--char_seq", type=str, nargs="+",
+                        default=["A sample of generated handwriting"],
+                        metavar="", help="input text, one or more lines")
+    parser.add_argument("--seq_len", type=int, default=400, metavar="",
+                        help="length of unconditional sequence")
+    parser.add_argument("--bias", type=float, default=10.0, metavar="",
+                        help="bias term")
+    parser.add_argument("--seed", type=int, metavar="", help="random seed")
+    parser.add_argument("--style", type=int, metavar="",
+                        help="style number [0,4]")
+    parser.add_argument("--styles_path", type=str, default="./styles/",
+                        metavar="", help="path to priming styles")
+    args = parser.parse_args()
+
+    return args
+
+
+def load_generator(scripted_path, device="cpu"):
+    generator = torch.jit.load(str(scripted_path), map_location=device)
+    generator.eval()
+    return generator
+
+
+def normalized_style(styles_path, style_idx):
+    """
+    Priming strokes normalized with their own mean/std, as in generate.py
+    """
+    styles = np.load(styles_path + 'style_strokes.npy', allow_pickle=True)
+    texts = np.load(styles_path + 'style_sents.npy', allow_pickle=True)
+    style = np.array(styles[style_idx], dtype=np.float32)
+    style[:, 1:] -= style[:, 1:].mean(axis=0)
+    style[:, 1:] /= style[:, 1:].std(axis=0)
+    return torch.from_numpy(style).unsqueeze(0), str(texts[style_idx])
+
+
+def run_generator(generator, char_seqs, bias, seq_len=400, style=None,
+                  real_text=""):
+    """
+    Returns:
+        list of denormalized (seq_len, 3) stroke arrays
+    """
+    with torch.no_grad():
+        if not hasattr(generator, "encode"):
+            gen_seq = generator(1, seq_len, bias, style)
+            return [gen_seq[0].cpu().numpy()]
+
+        text, text_mask = generator.encode([line + "  "
+                                            for line in char_seqs])
+        prime_text, prime_mask = None, None
+        if style is not None:
+            prime_text, prime_mask = generator.encode([real_text])
+        gen_seq, lengths = generator(text, text_mask, bias, 2000, style,
+                                     prime_text, prime_mask)
+
+    gen_seq = gen_seq.cpu().numpy()
+    return [gen_seq[i, :lengths[i]] for i in range(gen_seq.shape[0])]
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+    if not args.save_path.exists():
+        args.save_path.mkdir(parents=True, exist_ok=True)
+
+    if args.seed:
+        torch.manual_seed(args.seed)
+
+    generator = load_generator(args.scripted_path)
+
+    style, real_text = None, ""
+    if args.style is not None:
+        style, real_text = normalized_style(args.styles_path, args.style)
+
+    start_time = time.time()
+    gen_seqs = run_generator(generator, args.char_seq, args.bias,
+                             args.seq_len, style, real_text)
+    print(f"Generated {len(gen_seqs)} sequences in "
+          f"{time.time() - start_time:.2f}s")
+
+    for i, gen_seq in enumerate(gen_seqs):
+        npy_path = os.path.join(str(args.save_path),
+                                "gen_seq" + str(time.time()) + "_" + str(i) +
+                                ".npy")
+        np.save(npy_path, gen_seq)
+        print(f"Sequence saved as: {npy_path}")
@@ -1,98 +1,154 @@
 import torch
 import math
 import torch.nn as nn
-from torch.distributions import bernoulli  # , uniform
+from collections import namedtuple
+from typing import List, Tuple
+from torch import Tensor
 from utils.model_utils import stable_softmax
 
 
 def sample_from_out_dist(y_hat, bias):
-    split_sizes = [1] + [20] * 6
-    y = torch.split(y_hat, split_sizes, dim=0)
     """
-    Can softmax be replaced
-    Equation 16 to  25
+    Single row version of `sample_batch_from_out_dist`, expects a
+    (output_size,) vector and returns a (1, 1, 3) sample
     """
-    eos_prob = torch.sigmoid(y[0])
-    mixture_weights = stable_softmax(y[1] * (1 + bias), dim=0)
-    mu_1 = y[2]
-    mu_2 = y[3]
-    std_1 = torch.exp(y[4] - bias)
-    std_2 = torch.exp(y[5] - bias)
-    correlations = torch.tanh(y[6])
+    return sample_batch_from_out_dist(y_hat.unsqueeze(0), bias)
 
-    bernoulli_dist = bernoulli.Bernoulli(probs=eos_prob)
-    eos_sample = bernoulli_dist.sample()
 
+def sample_batch_from_out_dist(y_hat, bias, out=None):
+    """
+    Equation 16 to 25, draws one (eos, x, y) point per row of y_hat
+    (N, output_size) in a single vectorized pass. Only the parameters of
+    the selected mixture component are gathered and the correlated
+    bivariate gaussian is sampled in closed form (Cholesky factor of the
+    2x2 covariance), so no covariance matrix or host sync is needed.
+
+    Args:
+        out (N, 1, 3): optional preallocated output buffer
+    Returns:
+        (N, 1, 3) sample
+    """
+    # float32 also under bfloat16 autocast, exp(logstd - bias) is sensitive
+    y_hat = y_hat.float()
+    batch_size = y_hat.shape[0]
+    M = (y_hat.shape[1] - 1) // 6      # Number of mixture components
+
+    eos_prob = torch.sigmoid(y_hat[:, :1])
+    mixture_weights = stable_softmax(y_hat[:, 1:M + 1] * (1 + bias), dim=1)
     K = torch.multinomial(mixture_weights, 1)
 
-    mu_k = y_hat.new_zeros(2)
+    # mu_1, mu_2, logstd_1, logstd_2, rho of the selected component
+    params = y_hat[:, M + 1:].reshape(batch_size, 5, M)
+    params = params.gather(2, K.unsqueeze(1).expand(-1, 5, -1))
+    mu_1, mu_2, logstd_1, logstd_2, rho = params.squeeze(2).split(1, dim=1)
+    std_1 = torch.exp(logstd_1 - bias)
+    std_2 = torch.exp(logstd_2 - bias)
+    rho = torch.tanh(rho)
 
-    mu_k[0] = mu_1[K]
-    mu_k[1] = mu_2[K]
-    cov = y_hat.new_zeros(2, 2)
-    cov[0, 0] = std_1[K].pow(2)
-    cov[1, 1] = std_2[K].pow(2)
-    cov[0, 1], cov[1, 0] = (
-        correlations[K] * std_1[K] * std_2[K],
-        correlations[K] * std_1[K] * std_2[K],
-    )
+    noise = torch.randn(batch_size, 2, dtype=y_hat.dtype,
+                        device=y_hat.device)
+    uniform = torch.rand(batch_size, 1, dtype=y_hat.dtype,
+                         device=y_hat.device)
 
-    x = torch.normal(mean=torch.Tensor([0.0, 0.0]),
-                     std=torch.Tensor([1.0, 1.0])).to(y_hat.device)
-    Z = mu_k + torch.mv(cov, x)
+    eos_sample = (uniform < eos_prob).to(y_hat.dtype)
+    x_1 = mu_1 + std_1 * noise[:, 0:1]
+    x_2 = mu_2 + std_2 * (rho * noise[:, 0:1] +
+                          torch.sqrt(1 - rho.pow(2)) * noise[:, 1:2])
 
-    sample = y_hat.new_zeros(1, 1, 3)
-    sample[0, 0, 0] = eos_sample.item()
-    sample[0, 0, 1:] = Z
-    return sample
+    if out is None:
+        return torch.cat((eos_sample, x_1, x_2), dim=1).unsqueeze(1)
+    torch.cat((eos_sample, x_1, x_2), dim=1, out=out.view(batch_size, 3))
+    return out
 
 
-def sample_batch_from_out_dist(y_hat, bias):
+def lstm_cell_step(lstm, inp, hidden, cell):
     """
-    Can be removed
+    Advance a single layer `nn.LSTM` by one timestep on (N, input_size)
+    inputs, without the sequence dimension bookkeeping of `lstm.forward`.
     """
-    batch_size = y_hat.shape[0]
-    split_sizes = [1] + [20] * 6
-    y = torch.split(y_hat, split_sizes, dim=1)
-
-    eos_prob = torch.sigmoid(y[0])
-    mixture_weights = stable_softmax(y[1] * (1 + bias), dim=1)
-    mu_1 = y[2]
-    mu_2 = y[3]
-    std_1 = torch.exp(y[4] - bias)
-    std_2 = torch.exp(y[5] - bias)
-    correlations = torch.tanh(y[6])
-
-    bernoulli_dist = bernoulli.Bernoulli(probs=eos_prob)
-    eos_sample = bernoulli_dist.sample()
-
-    K = torch.multinomial(mixture_weights, 1).squeeze()
-
-    mu_k = y_hat.new_zeros((y_hat.shape[0], 2))
-
-    mu_k[:, 0] = mu_1[torch.arange(batch_size), K]
-    mu_k[:, 1] = mu_2[torch.arange(batch_size), K]
-    cov = y_hat.new_zeros(y_hat.shape[0], 2, 2)
-    cov[:, 0, 0] = std_1[torch.arange(batch_size), K].pow(2)
-    cov[:, 1, 1] = std_2[torch.arange(batch_size), K].pow(2)
-    cov[:, 0, 1], cov[:, 1, 0] = (
-        correlations[torch.arange(batch_size), K]
-        * std_1[torch.arange(batch_size), K]
-        * std_2[torch.arange(batch_size), K],
-        correlations[torch.arange(batch_size), K]
-        * std_1[torch.arange(batch_size), K]
-        * std_2[torch.arange(batch_size), K],
-    )
-
-    X = torch.normal(
-        mean=torch.zeros(batch_size, 2, 1), std=torch.ones(batch_size, 2, 1)
-    ).to(y_hat.device)
-    Z = mu_k + torch.matmul(cov, X).squeeze()
-
-    sample = y_hat.new_zeros(batch_size, 1, 3)
-    sample[:, 0, 0:1] = eos_sample
-    sample[:, 0, 1:] = Z.squeeze()
-    return sample
+    if not hasattr(lstm, "weight_ih_l0"):
+        # dynamically quantized LSTMs only expose the sequence API
+        _, (hidden, cell) = lstm(inp.unsqueeze(1),
+                                 (hidden.unsqueeze(0), cell.unsqueeze(0)))
+        return hidden.squeeze(0), cell.squeeze(0)
+    return torch.lstm_cell(inp, (hidden, cell), lstm.weight_ih_l0,
+                           lstm.weight_hh_l0, lstm.bias_ih_l0,
+                           lstm.bias_hh_l0)
+
+
+@torch.jit.script
+def attention_lstm_layer(inputs_proj: Tensor, weight_rec: Tensor,
+                         window_weight: Tensor, window_bias: Tensor,
+                         text: Tensor, text_mask: Tensor, hidden: Tensor,
+                         cell: Tensor, window: Tensor, kappa: Tensor
+                         ) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]:
+    """
+    Training loop of the first LSTM layer and the attention window
+    (Equation 46-51) over a whole sequence, as one scripted function.
+        inputs_proj (N, T, 4H) : stroke input projection plus biases of
+                                 lstm_1, for all timesteps at once
+        weight_rec (V + H, 4H) : window and hidden-to-hidden weights of
+                                 lstm_1, transposed
+        text (N, U)            : label ids, window (N, V), kappa (N, 10)
+    Returns:
+        hidden states (N, T, H), window vectors (N, T, V) and the last
+        hidden, cell and kappa
+    """
+    hid_1: List[Tensor] = []
+    windows: List[Tensor] = []
+    u = torch.arange(text.shape[1], dtype=inputs_proj.dtype,
+                     device=inputs_proj.device)
+
+    # unbound once, indexing every step would give a full size gradient
+    # per step in backward
+    for inp_proj in inputs_proj.unbind(1):
+        gates = inp_proj + torch.mm(torch.cat((window, hidden), 1),
+                                    weight_rec)
+        in_gate, forget_gate, cell_gate, out_gate = gates.chunk(4, 1)
+        cell = (torch.sigmoid(forget_gate) * cell +
+                torch.sigmoid(in_gate) * torch.tanh(cell_gate))
+        hidden = torch.sigmoid(out_gate) * torch.tanh(cell)
+
+        # kappa accumulates over the sequence, kept in float32
+        mix_params = torch.exp(
+            torch.addmm(window_bias, hidden, window_weight).float())
+        alpha, beta, kappa_hat = mix_params.chunk(3, 1)
+        kappa = kappa + kappa_hat
+        phi = torch.sum(alpha.unsqueeze(2) * torch.exp(
+            -beta.unsqueeze(2) * (kappa.unsqueeze(2) - u).pow(2)), dim=1)
+        window = torch.zeros_like(window).scatter_add(
+            1, text, phi * text_mask)
+
+        hid_1.append(hidden)
+        windows.append(window)
+
+    return (torch.stack(hid_1, dim=1), torch.stack(windows, dim=1), hidden,
+            cell, kappa)
+
+
+class SynthesisState(namedtuple("SynthesisState", [
+        "hidden", "cell", "window", "kappa", "text", "text_mask",
+        "encoding", "last_char"])):
+    """
+    Recurrent state of HandWritingSynthesisNet for step-wise inference.
+        hidden, cell : tuple of (N, hidden_size) tensors, one per layer
+        window       : (N, 1, vocab_size) previous window vector
+        kappa        : (N, 10, 1) previous attention positions
+        text, text_mask, encoding : conditioning text, its mask and its
+                       one-hot encoding, computed once per sequence
+        last_char    : (N, 1) index of the last character of each row
+    """
+    __slots__ = ()
+
+    def select(self, rows):
+        """
+        Keep only `rows` of the batch (index or boolean mask).
+        """
+        return SynthesisState(
+            tuple(h[rows] for h in self.hidden),
+            tuple(c[rows] for c in self.cell),
+            self.window[rows], self.kappa[rows], self.text[rows],
+            self.text_mask[rows], self.encoding[rows], self.last_char[rows])
 
 
 class HandWritingPredictionNet(nn.Module):
@@ -217,7 +273,6 @@ class HandWritingSynthesisNet(nn.Module):
         self.output_size = output_size
         self.n_layers = n_layers
         K = 10                      # Number of Gaussian Functions
-        self.EOS = False
         # self._phi = []              # Equation 46
 
         self.lstm_1 = nn.LSTM(3 + self.vocab_size,
@@ -254,15 +309,26 @@ class HandWritingSynthesisNet(nn.Module):
         """
         N = text.shape[0]
         U = text.shape[1]
-        encoding = text.new_zeros((N, U, self.vocab_size))
-        for i in range(N):
-            encoding[i, torch.arange(U), text[i].long()] = 1.0
+        encoding = text.new_zeros((N, U, self.vocab_size), dtype=torch.float32)
+        encoding.scatter_(2, text.long().unsqueeze(2), 1.0)
         return encoding
 
     def compute_window_vector(self, mix_params, prev_kappa, text, text_mask,
-                              ):  # is_map
-        encoding = self.one_hot_encoding(text)
-        mix_params = torch.exp(mix_params)
+                              encoding=None, last_char=None):  # is_map
+        """
+        Equation 46-47. With a precomputed one-hot `encoding` the window is
+        a batched matmul, otherwise the attention weights are scatter-added
+        straight into the character bins of `text` and the one-hot tensor
+        is never built (faster for training sized batches).
+        The per row end of sequence flags are only computed when the index
+        of the `last_char` of each row is given (generation), as a tensor
+        so the caller decides when to read them.
+        Returns:
+            window vector, kappa and the end of sequence flags (or None)
+        """
+        # kappa accumulates over the sequence, kept in float32 under
+        # bfloat16 autocast
+        mix_params = torch.exp(mix_params.float())
 
         alpha, beta, kappa = mix_params.split(10, dim=1)
 
@@ -273,14 +339,23 @@ class HandWritingSynthesisNet(nn.Module):
             text.shape[1], dtype=torch.float32, device=text.device)
 
         phi = torch.sum(alpha * torch.exp(-beta * (kappa - u).pow(2)), dim=1)
-        if phi[0, -1] > torch.max(phi[0, :-1]):
-            self.EOS = True
-        phi = (phi * text_mask).unsqueeze(2)
+        eos = None
+        if last_char is not None:
+            # a row has finished once its last character gets the most
+            # attention
+            phi_last = phi.gather(1, last_char)
+            phi_rest = phi.masked_fill(u >= last_char, -math.inf)
+            eos = phi_last.squeeze(1) > torch.max(phi_rest, dim=1)[0]
+        phi = (phi * text_mask).unsqueeze(1)
         # if is_map:
-        #     self._phi.append(phi.squeeze(dim=2).unsqueeze(1))
+        #     self._phi.append(phi)
 
-        window_vec = torch.sum(phi * encoding, dim=1, keepdim=True)
-        return window_vec, prev_kappa
+        if encoding is not None:
+            window_vec = torch.bmm(phi, encoding)
+        else:
+            window_vec = phi.new_zeros(phi.shape[0], 1, self.vocab_size)
+            window_vec.scatter_add_(2, text.long().unsqueeze(1), phi)
+        return window_vec, prev_kappa, eos
 
     def init_weight(self):
         k = math.sqrt(1.0 / self.hidden_size)
@@ -302,32 +377,53 @@ class HandWritingSynthesisNet(nn.Module):
     def forward(self, inputs, text, text_mask, initial_hidden, prev_window_vec,
                 prev_kappa):  # is_map=False
 
-        hid_1 = []
-        window_vec = []
+        # label ids used by the window scatter, converted once per sequence
+        text = text.long()
 
         state_1 = (initial_hidden[0][0:1], initial_hidden[1][0:1])
 
-        for t in range(inputs.shape[1]):
-            inp = torch.cat((inputs[:, t: t + 1, :], prev_window_vec), dim=2)
-
-            hid_1_t, state_1 = self.lstm_1(inp, state_1)
-            hid_1.append(hid_1_t)
-            # Equation 48-49
-            mix_params = self.window_layer(hid_1_t)
-            window, kappa = self.compute_window_vector(
-                mix_params.squeeze(dim=1).unsqueeze(2),
-                prev_kappa,
-                text,
-                text_mask,
-                # is_map,
-            )
+        if hasattr(self.lstm_1, "weight_ih_l0"):
+            # only the window input of lstm_1 is recurrent, the stroke
+            # inputs of all timesteps are projected in one matmul
+            n_in = inputs.shape[2]
+            weight_ih = self.lstm_1.weight_ih_l0
+            inputs_proj = torch.matmul(inputs, weight_ih[:, :n_in].t()) + \
+                self.lstm_1.bias_ih_l0 + self.lstm_1.bias_hh_l0
+            weight_rec = torch.cat((weight_ih[:, n_in:],
+                                    self.lstm_1.weight_hh_l0), dim=1).t()
+            hid_1, window_vec, hidden, cell, kappa = attention_lstm_layer(
+                inputs_proj, weight_rec, self.window_layer.weight.t(),
+                self.window_layer.bias, text, text_mask, state_1[0][0],
+                state_1[1][0], prev_window_vec.squeeze(1),
+                prev_kappa.squeeze(2))
+            state_1 = (hidden.unsqueeze(0), cell.unsqueeze(0))
+            prev_kappa = kappa.unsqueeze(2)
+        else:
+            # dynamically quantized lstm_1, one timestep at a time
+            hid_1 = []
+            window_vec = []
+            for t in range(inputs.shape[1]):
+                inp = torch.cat((inputs[:, t: t + 1, :], prev_window_vec),
+                                dim=2)
+
+                hid_1_t, state_1 = self.lstm_1(inp, state_1)
+                hid_1.append(hid_1_t)
+                # Equation 48-49
+                mix_params = self.window_layer(hid_1_t)
+                window, kappa, _ = self.compute_window_vector(
+                    mix_params.squeeze(dim=1).unsqueeze(2),
+                    prev_kappa,
+                    text,
+                    text_mask,
+                    # is_map,
+                )
 
-            prev_window_vec = window
-            prev_kappa = kappa
-            window_vec.append(window)
+                prev_window_vec = window
+                prev_kappa = kappa
+                window_vec.append(window)
 
-        hid_1 = torch.cat(hid_1, dim=1)
-        window_vec = torch.cat(window_vec, dim=1)
+            hid_1 = torch.cat(hid_1, dim=1)
+            window_vec = torch.cat(window_vec, dim=1)
 
         inp = torch.cat((inputs, hid_1, window_vec), dim=2)
         state_2 = (initial_hidden[0][1:2], initial_hidden[1][1:2])
@@ -344,59 +440,166 @@ class HandWritingSynthesisNet(nn.Module):
 
         return y_hat, [state_1, state_2, state_3], window_vec, prev_kappa
 
-    def generate(self, inp, text, text_mask, prime_text, prime_mask, hidden,
-                 window_vector, kappa, bias, prime=False):
-        # is_map = False
-        seq_len = 0
-        gen_seq = []
+    def init_state(self, text, text_mask, initial_hidden, window_vector,
+                   kappa):
+        """
+        Pack the `init_hidden` (or primed) state and the conditioning text
+        into a SynthesisState for `step`.
+        """
+        hidden = tuple(initial_hidden[0][i] for i in range(self.n_layers))
+        cell = tuple(initial_hidden[1][i] for i in range(self.n_layers))
+        last_char = text_mask.sum(dim=1, keepdim=True).long() - 1
+        return SynthesisState(hidden, cell, window_vector, kappa, text,
+                              text_mask, self.one_hot_encoding(text),
+                              last_char)
+
+    def step(self, inp, state):
+        """
+        Advance the network by exactly one timestep.
+
+        Args:
+            inp (N, 3): current stroke point
+            state (SynthesisState): state after the previous timestep
+        Returns:
+            y_hat (N, output_size), the next SynthesisState and the per row
+            end of sequence flags
+        """
+        h_1, c_1 = lstm_cell_step(
+            self.lstm_1, torch.cat((inp, state.window.squeeze(1)), dim=1),
+            state.hidden[0], state.cell[0])
+        # Equation 48-49
+        mix_params = self.window_layer(h_1)
+        window, kappa, eos = self.compute_window_vector(
+            mix_params.unsqueeze(2), state.kappa, state.text,
+            state.text_mask, encoding=state.encoding,
+            last_char=state.last_char)
+        window_t = window.squeeze(1)
+
+        h_2, c_2 = lstm_cell_step(
+            self.lstm_2, torch.cat((inp, h_1, window_t), dim=1),
+            state.hidden[1], state.cell[1])
+        h_3, c_3 = lstm_cell_step(
+            self.lstm_3, torch.cat((inp, h_2, window_t), dim=1),
+            state.hidden[2], state.cell[2])
+
+        y_hat = self.output_layer(torch.cat((h_1, h_2, h_3), dim=1))
+        state = state._replace(hidden=(h_1, h_2, h_3), cell=(c_1, c_2, c_3),
+                               window=window, kappa=kappa)
+
+        return y_hat, state, eos
+
+    def prime_hidden(self, inp, prime_text, prime_mask, hidden,
+                     window_vector, kappa):
+        """
+        Run the priming strokes `inp` written by `prime_text` through the
+        network. Only the recurrent state is kept from priming, generating
+        from it with fresh window and kappa is the same as `prime=True`.
+        Returns:
+            last time step (hidden, cell), each (n_layers, N, hidden_size)
+        """
         with torch.no_grad():
-            batch_size = inp.shape[0]
-            # print("batch_size:", batch_size)
-            if prime:
-                y_hat, state, window_vector, kappa = self.forward(
-                    inp, prime_text, prime_mask, hidden, window_vector, kappa,
-                    # is_map
-                )
-
-                _hidden = torch.cat([s[0] for s in state], dim=0)
-                _cell = torch.cat([s[1] for s in state], dim=0)
-                # last time step hidden state
-                hidden = (_hidden, _cell)
-                # # last time step window vector
-                # window_vector = window_vector[:, -1:, :]
-                # # last time step output vector
-                # y_hat = y_hat[:, -1, :]
-                # # y_hat = y_hat.squeeze()
-                # Z = sample_from_out_dist(y_hat, bias)
-                # inp = Z
-                # gen_seq.append(Z)
-                self.EOS = False
-                inp = inp.new_zeros(batch_size, 1, 3)
-                _, window_vector, kappa = self.init_hidden(
-                    batch_size, inp.device)
-
-            while not self.EOS and seq_len < 2000:
-                y_hat, state, window_vector, kappa = self.forward(
-                    inp, text, text_mask, hidden, window_vector, kappa, # is_map
-                )
-
-                _hidden = torch.cat([s[0] for s in state], dim=0)
-                _cell = torch.cat([s[1] for s in state], dim=0)
-                hidden = (_hidden, _cell)
-                # for batch sampling
-                # y_hat = y_hat.squeeze(dim=1)
-                # Z = sample_batch_from_out_dist(y_hat, bias)
-                y_hat = y_hat.squeeze()
-                Z = sample_from_out_dist(y_hat, bias)
-                inp = Z
-                gen_seq.append(Z)
+            _, state, _, _ = self.forward(inp, prime_text, prime_mask, hidden,
+                                          window_vector, kappa)
+        _hidden = torch.cat([s[0] for s in state], dim=0)
+        _cell = torch.cat([s[1] for s in state], dim=0)
+        return _hidden, _cell
+
+    @torch.no_grad()
+    def generate_steps(self, inp, text, text_mask, prime_text, prime_mask,
+                       hidden, window_vector, kappa, bias, prime=False,
+                       max_len=2000, eos_check_every=None):
+        """
+        Sampling loop of `generate` as an iterator. After every step yields
+        the rows of the batch still being generated (indices into `text`),
+        their sampled points (n_active, 3) and which of them just reached
+        their end of sequence, those are retired before the next step.
+
+        The end of sequence flags stay on the device and are only read
+        every `eos_check_every` steps (default: every step on CPU, where
+        it is cheap, every 8 steps on accelerators, where each read
+        serializes the loop). Points sampled in between after the end of
+        a row are dropped, rows just keep being sampled until the check.
+        """
+        if eos_check_every is None:
+            eos_check_every = 1 if inp.device.type == "cpu" else 8
+        batch_size = text.shape[0]
+        if prime:
+            hidden = self.prime_hidden(inp, prime_text, prime_mask, hidden,
+                                       window_vector, kappa)
+            inp = inp.new_zeros(batch_size, 1, 3)
+            _, window_vector, kappa = self.init_hidden(batch_size, inp.device)
+
+        # rows of the original batch which are still being generated
+        active = torch.arange(batch_size, device=inp.device)
+        state = self.init_state(text, text_mask, hidden, window_vector, kappa)
+        inp = inp[:, -1]
+        seq_len = 0
 
-                seq_len += 1
+        while active.shape[0] > 0 and seq_len < max_len:
+            n_steps = min(eos_check_every, max_len - seq_len)
+            # step of the block at which each row ended, n_steps if it
+            # did not
+            ended_at = torch.full(active.shape, n_steps, dtype=torch.long,
+                                  device=inp.device)
+            block = []
+            for t in range(n_steps):
+                y_hat, state, eos = self.step(inp, state)
+
+                Z = sample_batch_from_out_dist(y_hat, bias)
+                inp = Z.squeeze(dim=1)
+                block.append(inp)
+                ended_at.masked_fill_(eos & (ended_at == n_steps), t)
+            seq_len += n_steps
+
+            # the only host sync of the block
+            ended = ended_at.tolist()
+            for t, points in enumerate(block):
+                if t > min(ended):
+                    if t > max(ended):
+                        break
+                    rows = torch.tensor([end >= t for end in ended],
+                                        device=inp.device)
+                    yield active[rows], points[rows], ended_at[rows] == t
+                else:
+                    yield active, points, ended_at == t
+
+            if min(ended) < n_steps:
+                keep = torch.tensor([end == n_steps for end in ended],
+                                    device=inp.device)
+                active = active[keep]
+                inp = inp[keep]
+                state = state.select(keep)
 
-        gen_seq = torch.cat(gen_seq, dim=1)
-        gen_seq = gen_seq.cpu().numpy()
+    def generate(self, inp, text, text_mask, prime_text, prime_mask, hidden,
+                 window_vector, kappa, bias, prime=False, max_len=2000,
+                 return_lengths=False, eos_check_every=None):
+        """
+        Generate all rows of `text` in lockstep. Rows may hold different
+        lines padded with `text_mask`, a row is retired from the batch as
+        soon as its own end of sequence is reached (see `generate_steps`).
+        Returns:
+            ndarray (batch, max generated length, 3) zero padded after the
+            end of each row, and the per row lengths if `return_lengths`
+        """
+        seq_len = 0
+        batch_size = text.shape[0]
+        gen_seq = inp.new_zeros(batch_size, max_len, 3)
+        lengths = torch.full((batch_size,), max_len, dtype=torch.long,
+                             device=inp.device)
+
+        for active, points, finished in self.generate_steps(
+                inp, text, text_mask, prime_text, prime_mask, hidden,
+                window_vector, kappa, bias, prime, max_len,
+                eos_check_every):
+            gen_seq[active, seq_len] = points
+            seq_len += 1
+            # no host sync, rows only finish once
+            lengths[active] = torch.where(finished, seq_len, lengths[active])
+
+        gen_seq = gen_seq[:, :seq_len].cpu().numpy()
 
-        # print("EOS:", self.EOS)
         print("Lenght of generated sequence:", seq_len)
 
+        if return_lengths:
+            return gen_seq, lengths.cpu().numpy()
         return gen_seq
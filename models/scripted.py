@@ -0,0 +1,252 @@
+"""
+TorchScript-able generation modules.
+
+They reuse the weights of a trained HandWritingPredictionNet /
+HandWritingSynthesisNet but implement the whole generation loop (stepping,
+sampling and end of sequence) in TorchScript, together with the vocabulary
+and the train set offset statistics, so an exported file can be run with
+nothing but `torch.jit.load` (see `export.py` and `infer.py`).
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+import torch
+import torch.nn as nn
+from torch import Tensor
+
+
+class ScriptLSTMCell(nn.Module):
+    """
+    One timestep of a single layer `nn.LSTM`, sharing its parameters.
+    """
+
+    def __init__(self, lstm):
+        super(ScriptLSTMCell, self).__init__()
+        self.weight_ih = lstm.weight_ih_l0
+        self.weight_hh = lstm.weight_hh_l0
+        self.bias_ih = lstm.bias_ih_l0
+        self.bias_hh = lstm.bias_hh_l0
+
+    def forward(self, inp: Tensor, hidden: Tensor,
+                cell: Tensor) -> Tuple[Tensor, Tensor]:
+        return torch.lstm_cell(inp, (hidden, cell), self.weight_ih,
+                               self.weight_hh, self.bias_ih, self.bias_hh)
+
+
+def sample_mixture(y_hat: Tensor, bias: float) -> Tensor:
+    """
+    Scriptable `sample_batch_from_out_dist`, returns (N, 3) samples.
+    """
+    batch_size = y_hat.shape[0]
+    M = (y_hat.shape[1] - 1) // 6
+
+    eos_prob = torch.sigmoid(y_hat[:, :1])
+    mixture_weights = torch.softmax(y_hat[:, 1:M + 1] * (1 + bias), dim=1)
+    K = torch.multinomial(mixture_weights, 1)
+
+    params = y_hat[:, M + 1:].reshape(batch_size, 5, M)
+    params = params.gather(2, K.unsqueeze(1).expand(-1, 5, -1)).squeeze(2)
+    mu_1, mu_2 = params[:, 0:1], params[:, 1:2]
+    std_1 = torch.exp(params[:, 2:3] - bias)
+    std_2 = torch.exp(params[:, 3:4] - bias)
+    rho = torch.tanh(params[:, 4:5])
+
+    noise = torch.randn(batch_size, 2, dtype=y_hat.dtype,
+                        device=y_hat.device)
+    uniform = torch.rand(batch_size, 1, dtype=y_hat.dtype,
+                         device=y_hat.device)
+
+    eos_sample = (uniform < eos_prob).to(y_hat.dtype)
+    x_1 = mu_1 + std_1 * noise[:, 0:1]
+    x_2 = mu_2 + std_2 * (rho * noise[:, 0:1] +
+                          torch.sqrt(1 - rho.pow(2)) * noise[:, 1:2])
+    return torch.cat((eos_sample, x_1, x_2), dim=1)
+
+
+class ScriptedPredictionGenerator(nn.Module):
+
+    def __init__(self, model, train_mean, train_std):
+        super(ScriptedPredictionGenerator, self).__init__()
+        self.hidden_size = model.hidden_size
+        self.n_layers = model.n_layers
+        self.lstm_cells = nn.ModuleList(
+            [ScriptLSTMCell(lstm) for lstm in model.LSTM_layers])
+        self.output_layer = model.output_layer
+        self.register_buffer("train_mean",
+                             torch.as_tensor(train_mean, dtype=torch.float32))
+        self.register_buffer("train_std",
+                             torch.as_tensor(train_std, dtype=torch.float32))
+
+    def step(self, inp: Tensor, hidden: List[Tensor],
+             cell: List[Tensor]) -> Tuple[Tensor, List[Tensor], List[Tensor]]:
+        hiddens: List[Tensor] = []
+        cells: List[Tensor] = []
+        output = inp
+        for i, lstm_cell in enumerate(self.lstm_cells):
+            layer_inp = inp if i == 0 else torch.cat((inp, output), dim=1)
+            output, c = lstm_cell(layer_inp, hidden[i], cell[i])
+            hiddens.append(output)
+            cells.append(c)
+        y_hat = self.output_layer(torch.cat(hiddens, dim=1))
+        return y_hat, hiddens, cells
+
+    def forward(self, batch_size: int, seq_len: int, bias: float,
+                prime_seq: Optional[Tensor] = None) -> Tensor:
+        """
+        Returns denormalized (batch_size, seq_len, 3) offsets, preceded by
+        the priming strokes when `prime_seq` (1, T, 3) is given.
+        """
+        device = self.train_mean.device
+        hidden = [torch.zeros(batch_size, self.hidden_size, device=device)
+                  for _ in range(self.n_layers)]
+        cell = [torch.zeros(batch_size, self.hidden_size, device=device)
+                for _ in range(self.n_layers)]
+        inp = torch.zeros(batch_size, 3, device=device)
+        gen_seq: List[Tensor] = []
+
+        if prime_seq is not None:
+            prime_seq = prime_seq.expand(batch_size, -1, -1)
+            y_hat = torch.zeros(batch_size, 1, device=device)
+            for t in range(prime_seq.shape[1]):
+                y_hat, hidden, cell = self.step(prime_seq[:, t], hidden, cell)
+                gen_seq.append(prime_seq[:, t])
+            inp = sample_mixture(y_hat, bias)
+            gen_seq.append(inp)
+
+        for t in range(seq_len):
+            y_hat, hidden, cell = self.step(inp, hidden, cell)
+            inp = sample_mixture(y_hat, bias)
+            gen_seq.append(inp)
+
+        out = torch.stack(gen_seq, dim=1)
+        offsets = out[:, :, 1:] * self.train_std + self.train_mean
+        return torch.cat((out[:, :, :1], offsets), dim=2)
+
+
+class ScriptedSynthesisGenerator(nn.Module):
+
+    def __init__(self, model, train_mean, train_std, char_to_id):
+        super(ScriptedSynthesisGenerator, self).__init__()
+        self.hidden_size = model.hidden_size
+        self.vocab_size = model.vocab_size
+        self.lstm_1 = ScriptLSTMCell(model.lstm_1)
+        self.lstm_2 = ScriptLSTMCell(model.lstm_2)
+        self.lstm_3 = ScriptLSTMCell(model.lstm_3)
+        self.window_layer = model.window_layer
+        self.output_layer = model.output_layer
+        self.char_to_id: Dict[str, int] = {
+            str(char): int(idx) for char, idx in char_to_id.items()}
+        self.register_buffer("train_mean",
+                             torch.as_tensor(train_mean, dtype=torch.float32))
+        self.register_buffer("train_std",
+                             torch.as_tensor(train_std, dtype=torch.float32))
+
+    @torch.jit.export
+    def encode(self, lines: List[str]) -> Tuple[Tensor, Tensor]:
+        """
+        Label encode `lines`, zero padded, with their text mask.
+        """
+        max_char_len = 1
+        for line in lines:
+            max_char_len = max(max_char_len, len(line))
+        text = torch.zeros(len(lines), max_char_len, dtype=torch.long)
+        text_mask = torch.zeros(len(lines), max_char_len)
+        for i, line in enumerate(lines):
+            for j in range(len(line)):
+                text[i, j] = self.char_to_id[line[j]]
+            text_mask[i, :len(line)] = 1.0
+        device = self.train_mean.device
+        return text.to(device), text_mask.to(device)
+
+    def step(self, inp: Tensor, hidden: List[Tensor], cell: List[Tensor],
+             window: Tensor, kappa: Tensor, text: Tensor, text_mask: Tensor,
+             last_char: Tensor) -> Tuple[Tensor, List[Tensor], List[Tensor],
+                                         Tensor, Tensor, Tensor]:
+        h_1, c_1 = self.lstm_1(torch.cat((inp, window), dim=1),
+                               hidden[0], cell[0])
+
+        # Equation 46-51
+        mix_params = torch.exp(self.window_layer(h_1))
+        alpha, beta, kappa_hat = mix_params.split(10, dim=1)
+        kappa = kappa + kappa_hat
+        u = torch.arange(text.shape[1], dtype=torch.float32,
+                         device=text.device)
+        phi = torch.sum(alpha.unsqueeze(2) * torch.exp(
+            -beta.unsqueeze(2) * (kappa.unsqueeze(2) - u).pow(2)), dim=1)
+        phi_last = phi.gather(1, last_char).squeeze(1)
+        phi_rest = phi.masked_fill(u >= last_char, -math.inf)
+        eos = phi_last > torch.max(phi_rest, dim=1)[0]
+        phi = phi * text_mask
+        window = torch.zeros(phi.shape[0], self.vocab_size,
+                             device=phi.device).scatter_add(1, text, phi)
+
+        h_2, c_2 = self.lstm_2(torch.cat((inp, h_1, window), dim=1),
+                               hidden[1], cell[1])
+        h_3, c_3 = self.lstm_3(torch.cat((inp, h_2, window), dim=1),
+                               hidden[2], cell[2])
+        y_hat = self.output_layer(torch.cat((h_1, h_2, h_3), dim=1))
+
+        return y_hat, [h_1, h_2, h_3], [c_1, c_2, c_3], window, kappa, eos
+
+    def forward(self, text: Tensor, text_mask: Tensor, bias: float,
+                max_len: int = 2000, prime_seq: Optional[Tensor] = None,
+                prime_text: Optional[Tensor] = None,
+                prime_mask: Optional[Tensor] = None) -> Tuple[Tensor, Tensor]:
+        """
+        Generate every row of `text` (N, U) in lockstep, optionally primed
+        with `prime_seq` (1, T, 3) written by `prime_text`.
+        Returns:
+            denormalized (N, max length, 3) offsets, zero after the end of
+            each row, and the per row lengths
+        """
+        batch_size = text.shape[0]
+        device = text.device
+        hidden = [torch.zeros(batch_size, self.hidden_size, device=device)
+                  for _ in range(3)]
+        cell = [torch.zeros(batch_size, self.hidden_size, device=device)
+                for _ in range(3)]
+        window = torch.zeros(batch_size, self.vocab_size, device=device)
+        kappa = torch.zeros(batch_size, 10, device=device)
+
+        if prime_seq is not None and prime_text is not None \
+                and prime_mask is not None:
+            prime_seq = prime_seq.expand(batch_size, -1, -1)
+            prime_text = prime_text.expand(batch_size, -1)
+            prime_mask = prime_mask.expand(batch_size, -1)
+            prime_last = prime_mask.sum(dim=1, keepdim=True).long() - 1
+            for t in range(prime_seq.shape[1]):
+                _, hidden, cell, window, kappa, _ = self.step(
+                    prime_seq[:, t], hidden, cell, window, kappa,
+                    prime_text, prime_mask, prime_last)
+            # only the recurrent state is kept from priming
+            window = torch.zeros(batch_size, self.vocab_size, device=device)
+            kappa = torch.zeros(batch_size, 10, device=device)
+
+        last_char = text_mask.sum(dim=1, keepdim=True).long() - 1
+        gen_seq = torch.zeros(batch_size, max_len, 3, device=device)
+        lengths = torch.full((batch_size,), max_len, dtype=torch.long,
+                             device=device)
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        inp = torch.zeros(batch_size, 3, device=device)
+        seq_len = 0
+
+        while seq_len < max_len:
+            y_hat, hidden, cell, window, kappa, eos = self.step(
+                inp, hidden, cell, window, kappa, text, text_mask, last_char)
+            inp = sample_mixture(y_hat, bias)
+            gen_seq[:, seq_len] = inp
+            seq_len += 1
+
+            lengths = torch.where(eos & ~finished,
+                                  torch.full_like(lengths, seq_len), lengths)
+            finished = finished | eos
+            if bool(finished.all()):
+                break
+
+        gen_seq = gen_seq[:, :seq_len]
+        valid = torch.arange(seq_len, device=device) < lengths.unsqueeze(1)
+        offsets = gen_seq[:, :, 1:] * self.train_std + self.train_mean
+        gen_seq = torch.cat((gen_seq[:, :, :1], offsets), dim=2)
+        gen_seq = gen_seq * valid.unsqueeze(2).to(gen_seq.dtype)
+
+        return gen_seq, lengths
@@ -0,0 +1,126 @@
+"""
+Dynamic int8 quantization of a trained checkpoint for CPU inference.
+
+Reports the validation NLL (`compute_nll_loss`) and time of the float and
+the quantized model side by side, and optionally saves the (much smaller)
+quantized checkpoint, which `generate.py --quantize` loads directly.
+With `--bf16` the float model is also evaluated under bfloat16 autocast
+(`train.py --bf16`, `generate.py --bf16`).
+
+    python quantize.py --model_type synthesis \
+        --model_path ./pretrained/model_synthesis.pt --text_req
+"""
+
+import io
+import os
+import time
+import shutil
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from train import validation
+from generate import load_model, load_vocab_and_stats
+from utils.dataset import HandwritingDataset
+from utils.metadata import metadata_path
+
+
+def argparser():
+
+    parser = argparse.ArgumentParser(
+        description="Quantize handwriting model to int8")
+    parser.add_argument("--model_type", type=str, default="synthesis",
+                        metavar="", help="type of model")
+    parser.add_argument("--model_path", type=str,
+                        default="./pretrained/model_synthesis.pt", metavar="",
+                        help="path to trained weights")
+    parser.add_argument("--data_path", type=str, default="./data/", metavar="",
+                        help="path to processed training data")
+    parser.add_argument("--batch_size", type=int, default=32, metavar="",
+                        help="size of validation batch")
+    parser.add_argument("--text_req", action="store_true",
+                        help="flag indicating to fetch text data also")
+    parser.add_argument("--bf16", action="store_true",
+                        help="also evaluate with bfloat16 autocast")
+    parser.add_argument("--save_quantized", action="store_true",
+                        help="save quantized weights as <model>_int8.pt")
+    parser.add_argument("--seed", type=int, default=212, metavar="",
+                        help="random seed, same as training to get the "
+                             "same validation split")
+    args = parser.parse_args()
+
+    return args
+
+
+def state_dict_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def evaluate(model, valid_loader, device, model_type, bf16=False):
+    start_time = time.time()
+    loss = validation(model, valid_loader, device, 0, model_type, bf16)
+    return loss, time.time() - start_time
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    device = torch.device("cpu")
+    model_type = args.model_type
+
+    # same construction order as train.py to reproduce its validation split
+    train_dataset = HandwritingDataset(args.data_path, split="train",
+                                       text_req=args.text_req)
+    valid_dataset = HandwritingDataset(args.data_path, split="valid",
+                                       text_req=args.text_req)
+    valid_loader = DataLoader(valid_dataset, batch_size=args.batch_size,
+                              shuffle=False)
+
+    _, _, hyperparameters = load_vocab_and_stats(
+        model_type, args.model_path, args.data_path, text_req=args.text_req)
+    float_model = load_model(model_type, args.model_path, device,
+                             **hyperparameters)
+    int8_model = load_model(model_type, args.model_path, device,
+                            quantize=True, **hyperparameters)
+
+    print("[INFO] Evaluating float model....")
+    float_loss, float_time = evaluate(float_model, valid_loader, device,
+                                      model_type)
+    print("[INFO] Evaluating int8 model....")
+    int8_loss, int8_time = evaluate(int8_model, valid_loader, device,
+                                    model_type)
+
+    if args.bf16:
+        print("[INFO] Evaluating float model with bfloat16 autocast....")
+        bf16_loss, bf16_time = evaluate(float_model, valid_loader, device,
+                                        model_type, bf16=True)
+
+    float_size = state_dict_size(float_model)
+    int8_size = state_dict_size(int8_model)
+    print(f"[RESULT] float32\tVal NLL: {float_loss:.3f}"
+          f"\tTime: {float_time:.2f}s\tSize: {float_size / 1e6:.1f}MB")
+    print(f"[RESULT] int8\t\tVal NLL: {int8_loss:.3f}"
+          f"\tTime: {int8_time:.2f}s\tSize: {int8_size / 1e6:.1f}MB")
+    print(f"[RESULT] NLL change: {int8_loss - float_loss:+.3f} "
+          f"({(int8_loss - float_loss) / abs(float_loss) * 100:+.2f}%)"
+          f"\tSpeedup: {float_time / int8_time:.2f}x")
+    if args.bf16:
+        print(f"[RESULT] bfloat16\tVal NLL: {bf16_loss:.3f}"
+              f"\tTime: {bf16_time:.2f}s")
+        print(f"[RESULT] NLL change: {bf16_loss - float_loss:+.3f} "
+              f"({(bf16_loss - float_loss) / abs(float_loss) * 100:+.2f}%)"
+              f"\tSpeedup: {float_time / bf16_time:.2f}x")
+
+    if args.save_quantized:
+        int8_path = os.path.splitext(args.model_path)[0] + "_int8.pt"
+        torch.save(int8_model.state_dict(), int8_path)
+        if os.path.isfile(metadata_path(args.model_path)):
+            shutil.copyfile(metadata_path(args.model_path),
+                            metadata_path(int8_path))
+        print(f"[SAVED] Quantized weights saved at {int8_path}")
@@ -0,0 +1,434 @@
+"""
+Long-lived generation server.
+
+Loads the handwriting models once and keeps them warm, so a request only
+pays for sampling instead of interpreter start-up, imports, dataset
+construction and checkpoint loading.
+
+    python server.py --port 8000
+
+    POST /generate  {"text": "hello", "style": 1, "bias": 10.0,
+                     "seed": 42, "output": "img"}
+    POST /generate_stream  {"text": "hello", "style": 1, "chunk_size": 10}
+    GET  /health
+"""
+
+import json
+import os
+import time
+import queue
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+import torch
+from utils.render import RENDERERS
+from utils.constants import Global
+from utils.data_utils import data_denormalization
+from utils.result_cache import ResultCache
+from generate import (load_model, load_style, load_vocab_and_stats,
+                      load_style_cache, primed_style_state,
+                      model_digest, result_key, OUTPUT_EXTENSIONS,
+                      render_output,
+                      generate_unconditional_seq,
+                      generate_conditional_sequence,
+                      stream_conditional_sequence)
+
+OUTPUTS = ("strokes",) + tuple(OUTPUT_EXTENSIONS)
+
+
+def argparser():
+
+    parser = argparse.ArgumentParser(
+        description="PyTorch Handwriting Synthesis Server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", metavar="",
+                        help="address to bind")
+    parser.add_argument("--port", type=int, default=8000, metavar="",
+                        help="port to listen on")
+    parser.add_argument("--model_path", type=Path,
+                        default="./pretrained/model_synthesis.pt", metavar="",
+                        help="path to trained synthesis weights")
+    parser.add_argument("--prediction_model_path", type=Path,
+                        default="./pretrained/model_prediction.pt",
+                        metavar="", help="path to trained prediction weights")
+    parser.add_argument("--save_path", type=Path, default="./results/",
+                        metavar="", help="output path for rendered images")
+    parser.add_argument("--data_path", type=str, default="./data/", metavar="",
+                        help="path to processed training data "
+                             "(only for checkpoints without metadata)")
+    parser.add_argument("--styles_path", type=str, default="./styles/",
+                        metavar="", help="path to priming styles")
+    parser.add_argument("--quantize", action="store_true",
+                        help="dynamic int8 quantization for CPU inference")
+    parser.add_argument("--renderer", type=str, default="pillow",
+                        choices=RENDERERS, metavar="",
+                        help="png/gif renderer: pillow (fast) or matplotlib")
+    parser.add_argument("--style_cache_size", type=int, default=8,
+                        metavar="", help="#primed styles kept in memory")
+    parser.add_argument("--no_style_cache", action="store_true",
+                        help="keep primed styles in memory only, without "
+                             "reading or writing the on-disk cache")
+    parser.add_argument("--result_cache", type=str, metavar="",
+                        help="directory caching seeded generations")
+    parser.add_argument("--result_cache_size", type=int, default=256,
+                        metavar="", help="result cache size in MB")
+    args = parser.parse_args()
+
+    return args
+
+
+class GenerationService:
+    """
+    Holds the warm models, vocabulary and styles shared by all requests.
+    """
+
+    def __init__(self, model_path, prediction_model_path, data_path,
+                 styles_path, save_path, device, quantize=False,
+                 style_cache_size=8, style_cache_on_disk=True,
+                 result_cache_path=None, result_cache_size=256,
+                 renderer="pillow"):
+        self.device = device
+        self.save_path = save_path
+        self.renderer = renderer
+        # sampling and seeding touch global state, serialize requests
+        self.lock = threading.Lock()
+
+        self.models = {}
+        # train set mean/std used to denormalize each model's output
+        self.stats = {}
+        self.digests = {}
+        self.char_to_id, self.idx_to_char = {}, None
+        for model_type, path in (("prediction", prediction_model_path),
+                                 ("synthesis", model_path)):
+            if not os.path.isfile(path):
+                continue
+            char_to_id, idx_to_char, hyperparameters = load_vocab_and_stats(
+                model_type, path, data_path, text_req=True)
+            self.models[model_type] = load_model(model_type, path, device,
+                                                 quantize=quantize,
+                                                 **hyperparameters)
+            self.stats[model_type] = (Global.train_mean, Global.train_std)
+            self.digests[model_type] = model_digest(path, quantize)
+            if model_type == "synthesis":
+                self.char_to_id, self.idx_to_char = char_to_id, idx_to_char
+                self.style_cache = load_style_cache(
+                    path, quantize, style_cache_size, style_cache_on_disk)
+        if not self.models:
+            raise FileNotFoundError("No trained weights found at "
+                                    f"'{model_path}' or "
+                                    f"'{prediction_model_path}'")
+
+        # seeded requests are deterministic, their results can be reused
+        self.result_cache = None
+        if result_cache_path is not None:
+            self.result_cache = ResultCache(result_cache_path,
+                                            result_cache_size * 2**20)
+
+        self.styles = np.load(styles_path + 'style_strokes.npy',
+                              allow_pickle=True)
+        self.style_texts = np.load(styles_path + 'style_sents.npy',
+                                   allow_pickle=True)
+
+    def parse_style(self, request):
+        style_idx = request.get("style")
+        if style_idx is not None:
+            style_idx = int(style_idx)
+            if not 0 <= style_idx < len(self.styles):
+                raise ValueError(f"Style must be in [0, "
+                                 f"{len(self.styles) - 1}]")
+        return style_idx
+
+    def check_text(self, text):
+        missing = set(text) - set(self.char_to_id)
+        if missing:
+            raise ValueError(f"Unsupported characters: {sorted(missing)}")
+
+    def stream(self, request):
+        """
+        Validate a streaming request for the synthesis model.
+
+        Args:
+            request (dict): `text`, `style`, `bias`, `seed` and
+                `chunk_size` (points per message).
+        Returns:
+            iterator over messages, dicts with the denormalized `strokes`
+            of each chunk as soon as it is sampled, and a last one with
+            `done` and the timings.
+        """
+        if "synthesis" not in self.models:
+            raise ValueError("Model 'synthesis' is not loaded")
+        text = request.get("text", "A sample of generated handwriting")
+        bias = float(request.get("bias", 10.0))
+        seed = request.get("seed")
+        chunk_size = int(request.get("chunk_size", 10))
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        style_idx = self.parse_style(request)
+        self.check_text(text)
+        return self.stream_chunks(text, style_idx, bias, seed, chunk_size)
+
+    def stream_chunks(self, text, style_idx, bias, seed, chunk_size):
+        """
+        The chunks are sampled under the lock by a worker thread and queued,
+        the caller writes them to its client outside of the lock, so a slow
+        client never holds up other requests.
+        """
+        messages = queue.Queue()
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=self.produce_chunks, daemon=True,
+            args=(messages, stop, text, style_idx, bias, seed, chunk_size))
+        worker.start()
+        try:
+            while True:
+                message = messages.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            # the client went away, stop sampling
+            stop.set()
+
+    def produce_chunks(self, messages, stop, text, style_idx, bias, seed,
+                       chunk_size):
+        model = self.models["synthesis"]
+        train_mean, train_std = self.stats["synthesis"]
+        try:
+            with self.lock:
+                start_time = time.time()
+                if seed is not None:
+                    torch.manual_seed(int(seed))
+                    np.random.seed(int(seed))
+                style_state = None
+                if style_idx is not None:
+                    style_state = primed_style_state(
+                        model, self.style_cache, self.styles,
+                        self.style_texts, style_idx, self.char_to_id,
+                        self.device)
+
+                first_chunk_time = None
+                n_points = 0
+                for chunk in stream_conditional_sequence(
+                        model, text, self.device, self.char_to_id, bias,
+                        False, None, "", train_mean, train_std, chunk_size,
+                        style_state=style_state):
+                    if stop.is_set():
+                        return
+                    if first_chunk_time is None:
+                        first_chunk_time = time.time() - start_time
+                    n_points += len(chunk)
+                    messages.put({"strokes": chunk.tolist()})
+
+                messages.put({"done": True, "points": n_points,
+                              "first_chunk_time": first_chunk_time,
+                              "generation_time": time.time() - start_time})
+        except Exception as e:
+            # the response has started, report the error in the stream
+            messages.put({"error": f"{type(e).__name__}: {e}"})
+        finally:
+            messages.put(None)
+
+    def sample(self, model, model_type, text, style_idx, bias, seq_len,
+               seed):
+        """
+        Returns: denormalized generated strokes
+        """
+        if seed is not None:
+            torch.manual_seed(int(seed))
+            np.random.seed(int(seed))
+
+        style, real_text, style_state = None, "", None
+        if style_idx is not None and model_type == "synthesis":
+            style_state = primed_style_state(
+                model, self.style_cache, self.styles, self.style_texts,
+                style_idx, self.char_to_id, self.device)
+        elif style_idx is not None:
+            style, real_text = load_style(self.styles, self.style_texts,
+                                          style_idx, self.device)
+        prime = style is not None
+
+        if model_type == "prediction":
+            gen_seq = generate_unconditional_seq(
+                None, seq_len, self.device, bias, style=style,
+                prime=prime, model=model)
+        else:
+            gen_seq = generate_conditional_sequence(
+                None, text, self.device, self.char_to_id,
+                self.idx_to_char, bias, prime, style, real_text,
+                model=model, style_state=style_state)
+
+        train_mean, train_std = self.stats[model_type]
+        gen_seq = data_denormalization(train_mean, train_std, gen_seq)
+        return np.squeeze(gen_seq)
+
+    def generate(self, request):
+        """
+        Run one generation request.
+
+        Args:
+            request (dict): `text`, `model`, `style`, `bias`, `seed`,
+                `seq_len`, `output` (one of OUTPUTS) and for animations
+                `fps` and `points_per_frame`.
+        Returns:
+            dict with the denormalized `strokes` and, for rendered
+            outputs, the saved image `path`.
+        """
+        model_type = request.get("model", "synthesis")
+        if model_type not in self.models:
+            raise ValueError(f"Model '{model_type}' is not loaded")
+        model = self.models[model_type]
+        text = request.get("text", "A sample of generated handwriting")
+        bias = float(request.get("bias", 10.0))
+        seq_len = int(request.get("seq_len", 400))
+        seed = request.get("seed")
+        output = request.get("output", "strokes")
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output type: {output}")
+        fps = int(request.get("fps", 20))
+        points_per_frame = int(request.get("points_per_frame", 5))
+        if fps < 1 or points_per_frame < 1:
+            raise ValueError("fps and points_per_frame must be positive")
+
+        style_idx = self.parse_style(request)
+        if model_type == "synthesis":
+            self.check_text(text)
+
+        key = None
+        if self.result_cache is not None and seed is not None:
+            key = result_key(model_type, self.digests[model_type], text,
+                             style_idx, bias, seed, seq_len, self.device)
+
+        with self.lock:
+            start_time = time.time()
+            gen_seq = None
+            if key is not None:
+                gen_seq = self.result_cache.get_strokes(key)
+            if gen_seq is None:
+                gen_seq = self.sample(model, model_type, text, style_idx,
+                                      bias, seq_len, seed)
+                if key is not None:
+                    self.result_cache.put_strokes(key, gen_seq)
+            gen_time = time.time() - start_time
+
+        # rendering only reads gen_seq, other requests can sample meanwhile
+        response = {"strokes": gen_seq.tolist(),
+                    "generation_time": gen_time}
+        if output != "strokes":
+            path = os.path.join(str(self.save_path), "gen_img" +
+                                str(time.time()) + OUTPUT_EXTENSIONS[output])
+            render_output(gen_seq, output, path, self.renderer, fps,
+                          points_per_frame, self.result_cache, key)
+            response["path"] = path
+
+        return response
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, separators=(',', ':')).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        # the electron GUI is served from file://
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        health = {"status": "ok", "models": sorted(self.service.models)}
+        if self.service.result_cache is not None:
+            health["result_cache"] = self.service.result_cache.stats()
+        self.send_json(200, health)
+
+    def do_POST(self):
+        if self.path not in ("/generate", "/generate_stream"):
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("Request body must be a JSON object")
+            if self.path == "/generate_stream":
+                messages = self.service.stream(request)
+            else:
+                response = self.service.generate(request)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            # never leave the client (the GUI) without a response
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        if self.path == "/generate_stream":
+            self.send_stream(messages)
+        else:
+            self.send_json(200, response)
+
+    def send_stream(self, messages):
+        """
+        Write `messages` as they come, as server-sent events when the
+        client accepts them, newline delimited JSON otherwise.
+        """
+        sse = "text/event-stream" in self.headers.get("Accept", "")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse
+                         else "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            for message in messages:
+                data = json.dumps(message, separators=(',', ':'))
+                line = f"data: {data}\n\n" if sse else data + "\n"
+                self.wfile.write(line.encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away, stop generating
+            pass
+        finally:
+            messages.close()
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+    # no display inside the server, matplotlib is only imported on use
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    if not args.save_path.exists():
+        args.save_path.mkdir(parents=True, exist_ok=True)
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() and
+                          not args.quantize else "cpu")
+
+    print("[INFO] Loading models....")
+    GenerationRequestHandler.service = GenerationService(
+        args.model_path, args.prediction_model_path, args.data_path,
+        args.styles_path, args.save_path, device, quantize=args.quantize,
+        style_cache_size=args.style_cache_size,
+        style_cache_on_disk=not args.no_style_cache,
+        result_cache_path=args.result_cache,
+        result_cache_size=args.result_cache_size, renderer=args.renderer)
+
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 GenerationRequestHandler)
+    print(f"[INFO] Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
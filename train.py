@@ -1,19 +1,28 @@
 import math
 import os
+import sys
 import argparse
 import time
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributed as dist
 import torch.optim as optim
 from torch.optim.lr_scheduler import StepLR
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from models.models import HandWritingPredictionNet, HandWritingSynthesisNet
 from generate import generate_conditional_sequence, generate_unconditional_seq
 from utils.data_utils import data_denormalization
-from utils.model_utils import compute_nll_loss
-from utils.dataset import HandwritingDataset
+from utils.model_utils import compute_nll_loss, detach_state, autocast
+from utils.dataset import (HandwritingDataset, BucketBatchSampler,
+                           trim_collate)
 from utils.constants import Global
+from utils.metadata import save_metadata, model_hyperparameters
+from utils.distributed import (init_process, get_rank, get_world_size,
+                               is_main_process, broadcast_parameters,
+                               all_reduce_gradients, all_reduce_sum,
+                               all_reduce_max)
 from utils import plot_stroke
 
 
@@ -45,6 +54,17 @@ def argparser():
                         help="flag indicating to fetch text data also")
     parser.add_argument("--data_aug", action="store_true",
                         help="flag to whether data augmentation required")
+    parser.add_argument("--bucket", action="store_true",
+                        help="batch sequences of similar length together")
+    parser.add_argument("--tbptt_len", type=int, default=0, metavar="",
+                        help="truncated BPTT chunk length, 0 trains on "
+                             "full sequences")
+    parser.add_argument("--bf16", action="store_true",
+                        help="bfloat16 autocast on CPU")
+    parser.add_argument("--n_procs", type=int, default=1, metavar="",
+                        help="#data-parallel training processes (gloo)")
+    parser.add_argument("--master_port", type=int, default=29500,
+                        metavar="", help="port of the process group")
     parser.add_argument("--seed", type=int, default=212, metavar="",
                         help="random seed")
     args = parser.parse_args()
@@ -52,8 +72,19 @@ def argparser():
     return args
 
 
-def train_epoch(model, optimizer, epoch, train_loader, device, model_type):
+def train_epoch(model, optimizer, epoch, train_loader, device, model_type,
+                tbptt_len=0, bf16=False):
+    """
+    With `tbptt_len` each minibatch is split into chunks of that many
+    timesteps (truncated BPTT): the recurrent state is carried over to the
+    next chunk detached, and the optimizer steps after every chunk.
+    With `bf16` the forward pass runs under CPU bfloat16 autocast.
+    In distributed training gradients are averaged over processes and the
+    returned loss is averaged over the samples of all processes.
+    """
     avg_loss = 0.0
+    n_samples = 0
+    world_size = get_world_size()
     model.train()
     for i, mini_batch in enumerate(train_loader):
         if model_type == "prediction":
@@ -68,50 +99,82 @@ def train_epoch(model, optimizer, epoch, train_loader, device, model_type):
         mask = mask.to(device)
 
         batch_size = inputs.shape[0]
-
-        optimizer.zero_grad()
+        seq_len = inputs.shape[1]
+        if tbptt_len > 0 and world_size > 1:
+            # every process has to run the same number of chunks, padding
+            # is masked out of the loss
+            seq_len = all_reduce_max(seq_len)
+            pad = seq_len - inputs.shape[1]
+            inputs = F.pad(inputs, (0, 0, 0, pad))
+            targets = F.pad(targets, (0, 0, 0, pad))
+            mask = F.pad(mask, (0, pad))
+        chunk_len = tbptt_len if tbptt_len > 0 else seq_len
 
         if model_type == "prediction":
-            initial_hidden = model.init_hidden(batch_size, device)
-            y_hat, state = model.forward(inputs, initial_hidden)
+            hidden = model.init_hidden(batch_size, device)
         else:
-            initial_hidden, window_vector, kappa = model.init_hidden(
-                batch_size, device)
-            y_hat, state, window_vector, kappa = model.forward(
-                inputs, text, text_mask, initial_hidden, window_vector, kappa
-            )
+            hidden, window_vector, kappa = model.init_hidden(batch_size,
+                                                             device)
+
+        batch_loss = 0.0
+        for start in range(0, seq_len, chunk_len):
+            chunk = slice(start, start + chunk_len)
+
+            optimizer.zero_grad()
+
+            with autocast(bf16):
+                if model_type == "prediction":
+                    y_hat, state = model.forward(inputs[:, chunk], hidden)
+                else:
+                    y_hat, state, window_vec, kappa = model.forward(
+                        inputs[:, chunk], text, text_mask, hidden,
+                        window_vector, kappa
+                    )
+            if model_type == "synthesis":
+                window_vector = window_vec[:, -1:].detach()
+                kappa = kappa.detach()
+            hidden = detach_state(state)
 
-        loss = compute_nll_loss(targets, y_hat, mask)
+            loss = compute_nll_loss(targets[:, chunk], y_hat, mask[:, chunk])
 
-        # Output gradient clipping
-        y_hat.register_hook(lambda grad: torch.clamp(grad, -100, 100))
+            # Output gradient clipping
+            y_hat.register_hook(lambda grad: torch.clamp(grad, -100, 100))
 
-        loss.backward()
+            loss.backward()
+            if world_size > 1:
+                all_reduce_gradients(model)
 
-        # LSTM params gradient clipping
-        if model_type == "prediction":
-            nn.utils.clip_grad_value_(model.parameters(), 10)
-        else:
-            nn.utils.clip_grad_value_(model.lstm_1.parameters(), 10)
-            nn.utils.clip_grad_value_(model.lstm_2.parameters(), 10)
-            nn.utils.clip_grad_value_(model.lstm_3.parameters(), 10)
-            nn.utils.clip_grad_value_(model.window_layer.parameters(), 10)
+            # LSTM params gradient clipping
+            if model_type == "prediction":
+                nn.utils.clip_grad_value_(model.parameters(), 10)
+            else:
+                nn.utils.clip_grad_value_(model.lstm_1.parameters(), 10)
+                nn.utils.clip_grad_value_(model.lstm_2.parameters(), 10)
+                nn.utils.clip_grad_value_(model.lstm_3.parameters(), 10)
+                nn.utils.clip_grad_value_(model.window_layer.parameters(),
+                                          10)
 
-        optimizer.step()
-        avg_loss += loss.item()
+            optimizer.step()
+            batch_loss += loss.item()
+
+        avg_loss += batch_loss
+        n_samples += batch_size
 
         # print every 10 mini-batches
         if i % 10 == 0:
             print("\t[MiniBatch: {:3d}] loss: {:.3f}".format(
-                    i + 1, loss / batch_size))
+                    i + 1, batch_loss / batch_size))
 
-    avg_loss /= len(train_loader.dataset)
+    if world_size > 1:
+        avg_loss, n_samples = all_reduce_sum(avg_loss, n_samples)
+    avg_loss /= n_samples
 
     return avg_loss
 
 
-def validation(model, valid_loader, device, epoch, model_type):
+def validation(model, valid_loader, device, epoch, model_type, bf16=False):
     avg_loss = 0.0
+    n_samples = 0
     model.eval()
 
     with torch.no_grad():
@@ -129,20 +192,22 @@ def validation(model, valid_loader, device, epoch, model_type):
 
             batch_size = inputs.shape[0]
 
-            if model_type == "prediction":
-                initial_hidden = model.init_hidden(batch_size, device)
-                y_hat, state = model.forward(inputs, initial_hidden)
-            else:
-                initial_hidden, window_vector, kappa = model.init_hidden(
-                    batch_size, device
-                )
-                y_hat, state, window_vector, kappa = model.forward(
-                    inputs, text, text_mask, initial_hidden, window_vector,
-                    kappa
-                )
+            with autocast(bf16):
+                if model_type == "prediction":
+                    initial_hidden = model.init_hidden(batch_size, device)
+                    y_hat, state = model.forward(inputs, initial_hidden)
+                else:
+                    initial_hidden, window_vector, kappa = model.init_hidden(
+                        batch_size, device
+                    )
+                    y_hat, state, window_vector, kappa = model.forward(
+                        inputs, text, text_mask, initial_hidden,
+                        window_vector, kappa
+                    )
 
             loss = compute_nll_loss(targets, y_hat, mask)
             avg_loss += loss.item()
+            n_samples += batch_size
 
             # print every 10 mini-batches
             if i % 10 == 0:
@@ -152,13 +217,59 @@ def validation(model, valid_loader, device, epoch, model_type):
                     )
                 )
 
-    avg_loss /= len(valid_loader.dataset)
+    if get_world_size() > 1:
+        avg_loss, n_samples = all_reduce_sum(avg_loss, n_samples)
+    avg_loss /= n_samples
 
     return avg_loss
 
 
+def save_and_sample(model, model_path, model_type, train_loader, device,
+                    save_path, epoch):
+    """
+    Save the weights and their metadata, then plot a sample generated
+    with them.
+    """
+    print("[SAVE] Saving weights at epoch: {}".format(epoch))
+    torch.save(model.state_dict(), model_path)
+    # vocab, offset stats and hyperparameters needed for generation
+    save_metadata(model_path, model_type,
+                  model_hyperparameters(model_type, model),
+                  train_loader.dataset.id_to_char,
+                  Global.train_mean, Global.train_std)
+    if model_type == "prediction":
+        gen_seq = generate_unconditional_seq(model_path, 700, device,
+                                             bias=10.0, style=None,
+                                             prime=False)
+
+    else:
+        gen_seq = generate_conditional_sequence(
+            model_path,
+            "Hello world!",
+            device,
+            train_loader.dataset.char_to_id,
+            train_loader.dataset.idx_to_char,
+            bias=10.0,
+            prime=False,
+            prime_seq=None,
+            real_text=None
+        )
+
+    # denormalize the generated offsets using train set mean and std
+    gen_seq = data_denormalization(
+        Global.train_mean, Global.train_std, gen_seq)
+
+    # plot the sequence
+    plot_stroke(
+        gen_seq[0],
+        save_name=save_path + model_type +
+        "_seq_" + str(epoch) + ".png",
+    )
+
+
 def train(model, train_loader, valid_loader, batch_size, n_epochs, lr,
-          patience, step_size, device, model_type, save_path):
+          patience, step_size, device, model_type, save_path, tbptt_len=0,
+          bf16=False):
     model_path = save_path + "model_" + model_type + ".pt"
     model = model.to(device)
 
@@ -167,6 +278,8 @@ def train(model, train_loader, valid_loader, batch_size, n_epochs, lr,
         print(f"[ACTION] Loaded model weights from '{model_path}'")
     else:
         print("[INFO] No saved weights found, training from scratch.")
+    if get_world_size() > 1:
+        broadcast_parameters(model)
     optimizer = optim.Adam(model.parameters(), lr=lr)
     scheduler = StepLR(optimizer, step_size=step_size, gamma=0.1)
 
@@ -179,11 +292,15 @@ def train(model, train_loader, valid_loader, batch_size, n_epochs, lr,
         start_time = time.time()
         print(f"[Epoch {epoch + 1}/{n_epochs}]")
         print("[INFO] Training Model.....")
+        for sampler in (train_loader.sampler, train_loader.batch_sampler):
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
         train_loss = train_epoch(model, optimizer, epoch, train_loader,
-                                 device, model_type)
+                                 device, model_type, tbptt_len, bf16)
 
         print("[INFO] Validating Model....")
-        valid_loss = validation(model, valid_loader, device, epoch, model_type)
+        valid_loss = validation(model, valid_loader, device, epoch,
+                                model_type, bf16)
 
         train_losses.append(train_loss)
         valid_losses.append(valid_loss)
@@ -197,36 +314,10 @@ def train(model, train_loader, valid_loader, batch_size, n_epochs, lr,
         if valid_loss < best_loss:
             best_loss = valid_loss
             best_epoch = epoch + 1
-            print("[SAVE] Saving weights at epoch: {}".format(epoch + 1))
-            torch.save(model.state_dict(), model_path)
-            if model_type == "prediction":
-                gen_seq = generate_unconditional_seq(model_path, 700, device,
-                                                     bias=10.0, style=None,
-                                                     prime=False)
-
-            else:
-                gen_seq = generate_conditional_sequence(
-                    model_path,
-                    "Hello world!",
-                    device,
-                    train_loader.dataset.char_to_id,
-                    train_loader.dataset.idx_to_char,
-                    bias=10.0,
-                    prime=False,
-                    prime_seq=None,
-                    real_text=None
-                )
-
-            # denormalize the generated offsets using train set mean and std
-            gen_seq = data_denormalization(
-                Global.train_mean, Global.train_std, gen_seq)
-
-            # plot the sequence
-            plot_stroke(
-                gen_seq[0],
-                save_name=save_path + model_type +
-                "_seq_" + str(best_epoch) + ".png",
-            )
+            # replicas are identical, only rank 0 saves and samples
+            if is_main_process():
+                save_and_sample(model, model_path, model_type, train_loader,
+                                device, save_path, best_epoch)
             k = 0
         elif k > patience:
             print("Best model was saved at epoch: {}".format(best_epoch))
@@ -238,18 +329,16 @@ def train(model, train_loader, valid_loader, batch_size, n_epochs, lr,
         print('Time taken per epoch: {:.2f}s\n'.format(total_time_taken))
 
 
-if __name__ == "__main__":
-
-    args = argparser()
-
-    if not os.path.exists(args.save_path):
-        os.makedirs(args.save_path)
+def main(args):
+    os.makedirs(args.save_path, exist_ok=True)
 
     # fix random seed
     torch.manual_seed(args.seed)
     np.random.seed(args.seed)
 
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    # bfloat16 autocast and gloo data-parallel training are CPU modes
+    device = torch.device("cuda:0" if torch.cuda.is_available() and
+                          not args.bf16 and args.n_procs == 1 else "cpu")
 
     print('--ARGUMENTS--')
     for arg in vars(args):
@@ -268,10 +357,37 @@ if __name__ == "__main__":
                                        text_req=args.text_req,
                                        data_aug=args.data_aug)
 
-    train_loader = DataLoader(
-        train_dataset, batch_size=batch_size, shuffle=True)
-    valid_loader = DataLoader(
-        valid_dataset, batch_size=batch_size, shuffle=False)
+    # in distributed training every process loads its own shard
+    rank, world_size = get_rank(), get_world_size()
+    if args.bucket:
+        train_loader = DataLoader(
+            train_dataset, collate_fn=trim_collate,
+            batch_sampler=BucketBatchSampler(train_dataset.lengths,
+                                             batch_size, shuffle=True,
+                                             num_replicas=world_size,
+                                             rank=rank, seed=args.seed))
+        valid_loader = DataLoader(
+            valid_dataset, collate_fn=trim_collate,
+            batch_sampler=BucketBatchSampler(valid_dataset.lengths,
+                                             batch_size, shuffle=False,
+                                             num_replicas=world_size,
+                                             rank=rank, equal_shards=False))
+    elif world_size > 1:
+        train_loader = DataLoader(
+            train_dataset, batch_size=batch_size, collate_fn=trim_collate,
+            sampler=DistributedSampler(train_dataset, world_size, rank,
+                                       shuffle=True, seed=args.seed,
+                                       drop_last=True))
+        # validation shards without the padding of DistributedSampler,
+        # training drops the remainder instead so no sample counts twice
+        valid_loader = DataLoader(
+            valid_dataset, batch_size=batch_size, collate_fn=trim_collate,
+            sampler=range(rank, len(valid_dataset), world_size))
+    else:
+        train_loader = DataLoader(train_dataset, batch_size=batch_size,
+                                  shuffle=True, collate_fn=trim_collate)
+        valid_loader = DataLoader(valid_dataset, batch_size=batch_size,
+                                  shuffle=False, collate_fn=trim_collate)
 
     if model_type == "prediction":
         model = HandWritingPredictionNet(
@@ -283,4 +399,28 @@ if __name__ == "__main__":
                                         window_size=train_dataset.vocab_size)
 
     train(model, train_loader, valid_loader, batch_size, n_epochs, args.lr,
-          args.patience, args.step_size, device, model_type, args.save_path)
+          args.patience, args.step_size, device, model_type, args.save_path,
+          args.tbptt_len, args.bf16)
+
+
+def run_worker(rank, args):
+    """
+    One process of `--n_procs` data-parallel training.
+    """
+    init_process(rank, args.n_procs, args.master_port)
+    if rank != 0:
+        # only rank 0 reports progress
+        sys.stdout = open(os.devnull, "w")
+    main(args)
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+
+    args = argparser()
+
+    if args.n_procs > 1:
+        torch.multiprocessing.spawn(run_worker, args=(args,),
+                                    nprocs=args.n_procs)
+    else:
+        main(args)
@@ -1,9 +1,12 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, PillowWriter
+
+# matplotlib is imported by the plotting functions only, so inference
+# with the lightweight renderers in utils.render does not load it
 
 
 def plot_stroke(stroke, save_name=None):
+    import matplotlib.pyplot as plt
+
     # Plot a single example.
     f, ax = plt.subplots()
     x = np.cumsum(stroke[:, 1])
@@ -37,6 +40,9 @@ def plot_stroke(stroke, save_name=None):
 
 
 def plot_stroke_gif(stroke, save_name=None):
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation, PillowWriter
+
     fig, ax = plt.subplots()
 
     x = np.cumsum(stroke[:, 1])
@@ -1,3 +1,7 @@
+import os
+import numpy as np
+
+
 def train_offset_normalization(data):
     """
        The co-ordinate offsets are normalised to
@@ -11,6 +15,31 @@ def train_offset_normalization(data):
     return mean, std, data
 
 
+def train_offset_statistics(points, offsets, indices, max_len):
+    """
+       Same mean and std as `train_offset_normalization` on the zero padded
+       (len(indices), max_len, 3) training array, but computed from the
+       packed points so the padded array is never built.
+    """
+    n_padded = len(indices) * max_len
+    total = np.zeros(2, dtype=np.float64)
+    for i in indices:
+        total += points[offsets[i]:offsets[i + 1], 1:].sum(axis=0)
+    mean = total / n_padded
+
+    sq_dev = np.zeros(2, dtype=np.float64)
+    n_points = 0
+    for i in indices:
+        offs = points[offsets[i]:offsets[i + 1], 1:]
+        sq_dev += ((offs - mean) ** 2).sum(axis=0)
+        n_points += offs.shape[0]
+    # padded entries are 0, i.e. `-mean` after centering
+    sq_dev += (n_padded - n_points) * mean ** 2
+    std = np.sqrt(sq_dev / n_padded)
+
+    return mean.astype(np.float32), std.astype(np.float32)
+
+
 def valid_offset_normalization(mean, std, data):
     """
        The co-ordinate offsets are normalised to
@@ -41,3 +70,56 @@ def data_normalization(data):
     data[:, 1:] /= std
 
     return mean, std, data
+
+
+# Packed (ragged) dataset format, every file can be memory-mapped
+PACKED_POINTS = 'strokes_points.npy'        # (n_points, 3) float32
+PACKED_OFFSETS = 'strokes_offsets.npy'      # (n_total + 1,) int64
+PACKED_CHARS = 'sentences_chars.npy'        # (n_chars,) <U1
+PACKED_CHAR_OFFSETS = 'sentences_offsets.npy'   # (n_total + 1,) int64
+
+
+def pack_sequences(sequences, dtype):
+    """
+       Concatenate a list of arrays into one buffer plus the offsets of
+       every sequence, sequence `i` is buffer[offsets[i]:offsets[i + 1]].
+    """
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(seq) for seq in sequences])
+    if len(sequences) == 0:
+        return np.zeros((0,), dtype=dtype), offsets
+    return np.concatenate(sequences).astype(dtype, copy=False), offsets
+
+
+def save_packed_data(strokes, sents, path):
+    """
+       Save strokes and sentences in the packed format.
+    """
+    points, offsets = pack_sequences(strokes, np.float32)
+    chars, char_offsets = pack_sequences(
+        [np.array(list(sent), dtype='<U1') for sent in sents], '<U1')
+    np.save(os.path.join(path, PACKED_POINTS), points.reshape(-1, 3))
+    np.save(os.path.join(path, PACKED_OFFSETS), offsets)
+    np.save(os.path.join(path, PACKED_CHARS), chars)
+    np.save(os.path.join(path, PACKED_CHAR_OFFSETS), char_offsets)
+
+
+def has_packed_data(path):
+    return all(os.path.isfile(os.path.join(path, name))
+               for name in (PACKED_POINTS, PACKED_OFFSETS, PACKED_CHARS,
+                            PACKED_CHAR_OFFSETS))
+
+
+def load_packed_data(path):
+    """
+       Memory-map the packed stroke buffer, slices of it are zero-copy.
+       Returns:
+           points (memmap), offsets and the list of sentences
+    """
+    points = np.load(os.path.join(path, PACKED_POINTS), mmap_mode='r')
+    offsets = np.load(os.path.join(path, PACKED_OFFSETS))
+    chars = np.load(os.path.join(path, PACKED_CHARS))
+    char_offsets = np.load(os.path.join(path, PACKED_CHAR_OFFSETS))
+    sents = [''.join(chars[start:end])
+             for start, end in zip(char_offsets[:-1], char_offsets[1:])]
+    return points, offsets, sents
@@ -1,9 +1,10 @@
 import torch
 import numpy as np
 from collections import Counter
-from torch.utils.data import Dataset
-from utils.data_utils import train_offset_normalization,\
-                             valid_offset_normalization
+from torch.utils.data import Dataset, Sampler
+from torch.utils.data.dataloader import default_collate
+from utils.data_utils import (train_offset_statistics, pack_sequences,
+                              has_packed_data, load_packed_data)
 from utils.constants import Global
 
 
@@ -21,75 +22,53 @@ class HandwritingDataset(Dataset):
         self.max_seq_len = max_seq_len
         self.data_aug = data_aug
 
-        strokes = np.load(data_path + 'strokes.npy', allow_pickle=True,
-                          encoding='bytes')
-        with open(data_path + 'sentences.txt') as file:
-            texts = file.read().splitlines()
+        if has_packed_data(data_path):
+            # memory-mapped, items are sliced from the shared buffer
+            points, offsets, texts = load_packed_data(data_path)
+        else:
+            strokes = np.load(data_path + 'strokes.npy', allow_pickle=True,
+                              encoding='bytes')
+            with open(data_path + 'sentences.txt') as file:
+                texts = file.read().splitlines()
+            points, offsets = pack_sequences(list(strokes), np.float32)
+            points = points.reshape(-1, 3)
+            del strokes
 
         # list of length of each stroke in strokes
-        lengths = [len(stroke) for stroke in strokes]
-        max_len = np.max(lengths)
-        n_total = len(strokes)
-
-        # Mask - Padding (strokes data)
-        mask_shape = (n_total, max_len)
-        sequence_mask = np.zeros(mask_shape, dtype=np.float32)
-
-        # Convert list of str into array of list of chars
-        char_seqs = [list(char_seq) for char_seq in texts]
-        char_seqs = np.asarray(char_seqs, dtype=object)
-
-        char_lens = [len(char_seq) for char_seq in char_seqs]
-        max_char_len = np.max(char_lens)
-
-        # char Mask
-        mask_shape = (n_total, max_char_len)  # (6000,64)
-        char_mask = np.zeros(mask_shape, dtype=np.float32)
-
-        # Input text array
-        inp_text = np.ndarray((n_total, max_char_len), dtype='<U1')
-        inp_text[:, :] = ' '
+        lengths = np.diff(offsets)
+        self.max_len = int(np.max(lengths))
+        n_total = len(lengths)
 
-        # Convert list of stroke(array) into ndarray of size(n_total,max_len,3)
-        data_shape = (n_total, max_len, 3)
-        strokes_data = np.zeros(data_shape, dtype=np.float32)
+        char_lens = np.array([len(char_seq) for char_seq in texts])
+        self.max_char_len = int(np.max(char_lens))
 
-        for i, (seq_len, text_len) in enumerate(zip(lengths, char_lens)):
-            sequence_mask[i, :seq_len] = 1.
-            strokes_data[i, :seq_len] = strokes[i]
-            char_mask[i, :text_len] = 1.
-            inp_text[i, :text_len] = char_seqs[i]
-
-        # create vocab
-        self.id_to_char, self.char_to_id = self.build_vocab(inp_text)
+        # create vocab, ' ' is also the text padding character
+        self.id_to_char, self.char_to_id = self.build_vocab(texts + [' '])
         self.vocab_size = len(self.id_to_char)
 
         idx_permute = np.random.permutation(n_total)
-        strokes_data = strokes_data[idx_permute]
-        sequence_mask = sequence_mask[idx_permute]
-        inp_text = inp_text[idx_permute]
-        char_mask = char_mask[idx_permute]
 
-        n_train = int(0.9 * strokes_data.shape[0])
-        self._data = strokes_data
+        n_train = int(0.9 * n_total)
+        self.points = points
+        self.offsets = offsets
+        self.texts = texts
         if split == 'train':
-            self.dataset = strokes_data[:n_train]
-            self.mask = sequence_mask[:n_train]
-            self.texts = inp_text[:n_train]
-            self.char_mask = char_mask[:n_train]
-            Global.train_mean, Global.train_std, self.dataset = \
-                train_offset_normalization(self.dataset)
-
+            self.indices = idx_permute[:n_train]
+            Global.train_mean, Global.train_std = train_offset_statistics(
+                points, offsets, self.indices, self.max_len)
         elif split == 'valid':
-            self.dataset = strokes_data[n_train:]
-            self.mask = sequence_mask[n_train:]
-            self.texts = inp_text[n_train:]
-            self.char_mask = char_mask[n_train:]
-            self.dataset = valid_offset_normalization(
-                Global.train_mean, Global.train_std, self.dataset)
+            self.indices = idx_permute[n_train:]
+        self.mean = Global.train_mean
+        self.std = Global.train_std
+
+        # true (unpadded) length of every sequence, used for bucketing
+        self.lengths = lengths[self.indices]
+        self.char_lens = char_lens[self.indices]
+        if self.data_aug:
+            self.lengths = np.minimum(self.lengths, self.max_seq_len)
 
     def __len__(self):
-        return self.dataset.shape[0]
+        return len(self.indices)
 
     def idx_to_char(self, id_seq):
         return np.array([self.id_to_char[id] for id in id_seq])
@@ -108,21 +87,46 @@ class HandwritingDataset(Dataset):
         char_to_id_dic = {v: k for k, v in id_to_char_dic.items()}
         return id_to_char_dic, char_to_id_dic
 
+    def stroke(self, idx):
+        """
+        Normalized offsets of item `idx`, only this item is read from the
+        (memory-mapped) points buffer.
+        """
+        seq_idx = self.indices[idx]
+        stroke = np.array(self.points[self.offsets[seq_idx]:
+                                      self.offsets[seq_idx + 1]])
+        stroke[:, 1:] -= self.mean
+        stroke[:, 1:] /= self.std
+        return stroke
+
+    def padded_item(self, stroke, pad_len):
+        """
+        Zero pad `stroke` to `pad_len`, returns (input_seq, target, mask)
+        with the input shifted by one timestep.
+        """
+        seq_len = stroke.shape[0]
+        target = torch.zeros(pad_len, 3, dtype=torch.float32)
+        target[:seq_len] = torch.from_numpy(stroke)
+        input_seq = torch.zeros(pad_len, 3, dtype=torch.float32)
+        input_seq[1:] = target[:-1]
+        mask = torch.zeros(pad_len, dtype=torch.float32)
+        mask[:seq_len] = 1.
+        return input_seq, target, mask
+
     def __getitem__(self, idx):
 
-        mask = torch.from_numpy(self.mask[idx])
+        stroke = self.stroke(idx)
 
         if self.text_req:
-            input_seq = torch.zeros(self.dataset[idx].shape,
-                                    dtype=torch.float32)
-            input_seq[1:, :] = torch.from_numpy(self.dataset[idx, :-1, :])
-
-            target = torch.from_numpy(self.dataset[idx])
-            text = torch.from_numpy(self.char_to_idx(self.texts[idx]))
-            char_mask = torch.from_numpy(self.char_mask[idx])
+            input_seq, target, mask = self.padded_item(stroke, self.max_len)
+            char_seq = self.texts[self.indices[idx]]
+            char_seq = char_seq + ' ' * (self.max_char_len - len(char_seq))
+            text = torch.from_numpy(self.char_to_idx(char_seq))
+            char_mask = torch.zeros(self.max_char_len, dtype=torch.float32)
+            char_mask[:self.char_lens[idx]] = 1.
             return (input_seq, target, mask, text, char_mask)
         elif self.data_aug:
-            seq_len = len(torch.nonzero(mask, as_tuple=False).to(mask.device))
+            seq_len = stroke.shape[0]
             start = 0
             end = self.max_seq_len
 
@@ -130,18 +134,106 @@ class HandwritingDataset(Dataset):
                 start = np.random.randint(0, high=seq_len - self.max_seq_len)
                 end = start + self.max_seq_len
 
-            stroke = self.dataset[idx, start:end, :]
+            return self.padded_item(stroke[start:end], self.max_seq_len)
+        else:
+            return self.padded_item(stroke, self.max_len)
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batches of sequences with similar lengths.
 
-            input_seq = torch.zeros(stroke.shape, dtype=torch.float32)
-            input_seq[1:, :] = torch.from_numpy(stroke[:-1, :])
+    Indices are shuffled, split into buckets of `bucket_size` batches,
+    sorted by length inside each bucket and cut into batches, whose order
+    is shuffled again. Combined with `trim_collate` every batch is only
+    padded to its own longest sequence.
 
-            target = torch.from_numpy(stroke)
-            mask = mask[start:end]
+    With `num_replicas` > 1 (distributed training) every process builds
+    the same batches, shuffled from `seed` and the epoch set with
+    `set_epoch`, and takes every `num_replicas`-th one. With
+    `equal_shards` the last `len(batches) % num_replicas` batches are
+    dropped so that all processes get the same number of them without
+    training twice on any sample.
+    """
 
-            return (input_seq, target, mask)
+    def __init__(self, lengths, batch_size, bucket_size=50, shuffle=True,
+                 drop_last=False, num_replicas=1, rank=0, seed=0,
+                 equal_shards=True):
+        """
+        Args:
+            lengths (array): sequence length of every dataset item
+            bucket_size (int): #batches sorted together
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.equal_shards = equal_shards
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random
+        if self.num_replicas > 1:
+            # identical on every process
+            rng = np.random.RandomState(self.seed + self.epoch)
+        if self.shuffle:
+            indices = rng.permutation(len(self.lengths))
+        else:
+            indices = np.arange(len(self.lengths))
+
+        n_bucket = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), n_bucket):
+            bucket = indices[start: start + n_bucket]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            for i in range(0, len(bucket), self.batch_size):
+                batch = bucket[i: i + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        if self.num_replicas > 1:
+            if self.equal_shards:
+                n_equal = len(batches) // self.num_replicas * \
+                    self.num_replicas
+                batches = batches[:n_equal]
+            batches = batches[self.rank::self.num_replicas]
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            n_batches = len(self.lengths) // self.batch_size
         else:
-            input_seq = torch.zeros(self.dataset[idx].shape,
-                                    dtype=torch.float32)
-            input_seq[1:, :] = torch.from_numpy(self.dataset[idx, :-1, :])
-            target = torch.from_numpy(self.dataset[idx])
-            return (input_seq, target, mask)
+            n_batches = -(-len(self.lengths) // self.batch_size)
+        if self.num_replicas == 1:
+            return n_batches
+        if self.equal_shards:
+            return n_batches // self.num_replicas
+        return len(range(self.rank, n_batches, self.num_replicas))
+
+
+def trim_collate(batch):
+    """
+    `default_collate` and trim the padding to the longest sequence (and
+    longest text) of the batch. Padding is masked out of the loss, so the
+    result is unchanged while the models run fewer timesteps.
+    """
+    batch = default_collate(batch)
+    mask = batch[2]
+    seq_len = max(int(mask.sum(dim=1).max()), 1)
+    batch = [item[:, :seq_len] for item in batch[:3]] + batch[3:]
+    if len(batch) == 5:
+        char_mask = batch[4]
+        char_len = max(int(char_mask.sum(dim=1).max()), 1)
+        batch[3] = batch[3][:, :char_len]
+        batch[4] = char_mask[:, :char_len]
+    return batch
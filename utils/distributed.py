@@ -0,0 +1,79 @@
+"""
+Multi-process data-parallel training on CPU with the gloo backend.
+
+Every process holds a full replica of the model and trains on its own
+shard of the data, gradients are averaged over processes after every
+backward pass so the replicas stay identical.
+"""
+
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_process(rank, world_size, master_port=29500):
+    """
+    Join the process group of `world_size` local processes and split the
+    CPU cores between them.
+    """
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", str(master_port))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+
+def get_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+def get_rank():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def broadcast_parameters(model):
+    """
+    Copy the parameters and buffers of rank 0 to every process.
+    """
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, 0)
+
+
+def all_reduce_gradients(model):
+    """
+    Average the gradients over processes, in one flat all-reduce.
+    """
+    params = [param for param in model.parameters() if param.requires_grad]
+    for param in params:
+        if param.grad is None:
+            param.grad = torch.zeros_like(param)
+    flat = torch.cat([param.grad.reshape(-1) for param in params])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+    offset = 0
+    for param in params:
+        numel = param.grad.numel()
+        param.grad.copy_(flat[offset: offset + numel].view_as(param.grad))
+        offset += numel
+
+
+def all_reduce_sum(*values):
+    """
+    Sums of python numbers over processes.
+    """
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def all_reduce_max(value):
+    tensor = torch.tensor([value], dtype=torch.long)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return int(tensor.item())
@@ -0,0 +1,80 @@
+import os
+import json
+import numpy as np
+
+METADATA_VERSION = 1
+
+
+def metadata_path(model_path):
+    """
+    Metadata is stored next to the checkpoint, `model_x.pt` -> `model_x.json`
+    """
+    return os.path.splitext(str(model_path))[0] + ".json"
+
+
+def model_hyperparameters(model_type, model):
+    """
+       Constructor arguments needed to rebuild `model` at inference time.
+    """
+    hyperparameters = {
+        "hidden_size": model.hidden_size,
+        "n_layers": model.n_layers,
+        "output_size": model.output_size,
+    }
+    if model_type == "prediction":
+        hyperparameters["input_size"] = model.input_size
+    else:
+        hyperparameters["window_size"] = model.vocab_size
+
+    return hyperparameters
+
+
+def save_metadata(model_path, model_type, hyperparameters, id_to_char,
+                  train_mean, train_std):
+    """
+       Write vocabulary, train set offset statistics and model
+       hyperparameters so generation does not need the training data.
+    """
+    metadata = {
+        "version": METADATA_VERSION,
+        "model_type": model_type,
+        "hyperparameters": hyperparameters,
+        "vocab": [id_to_char[i] for i in range(len(id_to_char))],
+        "train_mean": np.asarray(train_mean, dtype=np.float32).tolist(),
+        "train_std": np.asarray(train_std, dtype=np.float32).tolist(),
+    }
+    path = metadata_path(model_path)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(metadata, file, ensure_ascii=False)
+
+    return path
+
+
+def load_metadata(model_path):
+    """
+       Raises FileNotFoundError for checkpoints saved without metadata.
+    """
+    with open(metadata_path(model_path), encoding='utf-8') as file:
+        metadata = json.load(file)
+    if metadata.get("version") != METADATA_VERSION:
+        raise ValueError(f"Unsupported metadata version: "
+                         f"{metadata.get('version')}")
+    metadata["train_mean"] = np.asarray(metadata["train_mean"],
+                                        dtype=np.float32)
+    metadata["train_std"] = np.asarray(metadata["train_std"],
+                                       dtype=np.float32)
+
+    return metadata
+
+
+def vocab_from_metadata(metadata):
+    """
+       Same `char_to_id` / `idx_to_char` interface as HandwritingDataset.
+    """
+    id_to_char = dict(enumerate(metadata["vocab"]))
+    char_to_id = {v: k for k, v in id_to_char.items()}
+
+    def idx_to_char(id_seq):
+        return np.array([id_to_char[int(id)] for id in id_seq])
+
+    return char_to_id, idx_to_char
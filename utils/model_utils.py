@@ -1,3 +1,5 @@
+import hashlib
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -5,6 +7,8 @@ import math
 
 
 def stable_softmax(X, dim=2):
+    # float32 also under bfloat16 autocast
+    X = X.float()
     max_vec = torch.max(X, dim, keepdim=True)
     exp_X = torch.exp(X - max_vec[0])
     sum_exp_X = torch.sum(exp_X, dim, keepdim=True)
@@ -14,10 +18,13 @@ def stable_softmax(X, dim=2):
 
 def compute_nll_loss(targets, y_hat, mask, M=20):
     epsilon = 1e-6
+    # bfloat16 under autocast, the log-sum-exp and the 1 - rho^2 terms
+    # need float32
+    y_hat = y_hat.float()
     split_sizes = [1] + [20] * 6
     y = torch.split(y_hat, split_sizes, dim=2)
 
-    eos_logit = y[0].squeeze()
+    eos_logit = y[0].squeeze(2)
     log_mixture_weights = F.log_softmax(y[1], dim=2)
 
     mu_1 = y[2]
@@ -52,3 +59,52 @@ def compute_nll_loss(targets, y_hat, mask, M=20):
     loss = torch.sum(loss_t * mask)
 
     return loss
+
+
+def autocast(enabled=True):
+    """
+    bfloat16 autocast context for CPU training and inference (needs
+    torch >= 1.10), a no-op when not `enabled`. Softmax, the loss, the
+    attention window and the sampler stay in float32.
+    """
+    if not enabled:
+        return contextlib.nullcontext()
+    if not hasattr(torch, "autocast"):
+        raise RuntimeError("bfloat16 autocast needs torch >= 1.10, found "
+                           f"torch {torch.__version__}")
+    return torch.autocast("cpu", dtype=torch.bfloat16)
+
+
+def detach_state(state):
+    """
+    Stack the per layer (h, c) tuples returned by `forward` into the
+    `init_hidden` format, detached from the graph (truncated BPTT).
+    """
+    hidden = torch.cat([h for h, _ in state], dim=0).detach()
+    cell = torch.cat([c for _, c in state], dim=0).detach()
+    return hidden, cell
+
+
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of the LSTM and Linear layers, weights are
+    stored as int8 and activations quantized on the fly (CPU only).
+    """
+    return torch.quantization.quantize_dynamic(
+        model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def is_quantized_state_dict(state_dict):
+    return any(key.endswith(("_packed_params", "_all_weight_values.0.param"))
+               for key in state_dict)
+
+
+def checkpoint_digest(model_path, chunk_size=1 << 20):
+    """
+    SHA-1 of the checkpoint file, identifies the weights in caches.
+    """
+    digest = hashlib.sha1()
+    with open(model_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,199 @@
+"""
+Lightweight renderers drawing stroke arrays straight to SVG or PNG
+(Pillow), without building a matplotlib figure.
+"""
+
+import numpy as np
+
+
+def stroke_points(stroke, scale=4.0, padding=20):
+    """
+    Absolute points of `stroke` (offsets in format [eos, x, y]) in image
+    coordinates: `scale` pixels per unit, y pointing down, `padding` pixels
+    around the writing.
+    Returns:
+        (seq_len, 2) array and the (width, height) of the image
+    """
+    xy = np.cumsum(stroke[:, 1:], axis=0)
+    if not len(xy):
+        return np.zeros((0, 2)), (2 * padding, 2 * padding)
+    xy_min = xy.min(axis=0)
+    xy_max = xy.max(axis=0)
+    points = np.empty_like(xy, dtype=np.float64)
+    points[:, 0] = (xy[:, 0] - xy_min[0]) * scale + padding
+    points[:, 1] = (xy_max[1] - xy[:, 1]) * scale + padding
+    size = np.ceil((xy_max - xy_min) * scale).astype(int) + 2 * padding
+    return points, (int(size[0]), int(size[1]))
+
+
+def split_segments(points, eos, start=0):
+    """
+    Split `points` into pen down segments, the point with eos = 1 is the
+    last one of its stroke. `start` is the index of `points[0]` in `eos`.
+    """
+    cuts = np.where(eos[start:start + len(points) - 1] == 1)[0] + 1
+    return [seg for seg in np.split(points, cuts) if len(seg) > 1]
+
+
+def stroke_segments(stroke, scale=4.0, padding=20):
+    """
+    Returns:
+        list of (n, 2) pen down segments in image coordinates and the
+        (width, height) of the image
+    """
+    points, size = stroke_points(stroke, scale, padding)
+    return split_segments(points, stroke[:, 0]), size
+
+
+def stroke_to_svg(stroke, save_name=None, scale=4.0, linewidth=3.0,
+                  padding=20):
+    """
+    Draw `stroke` as a single SVG path, one subpath per pen down segment.
+    Returns: the SVG document, also written to `save_name` if given
+    """
+    segments, (width, height) = stroke_segments(stroke, scale, padding)
+    path = " ".join(
+        "M" + " L".join(f"{x:.1f},{y:.1f}" for x, y in seg)
+        for seg in segments)
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+           f'height="{height}" viewBox="0 0 {width} {height}">'
+           f'<rect width="100%" height="100%" fill="white"/>'
+           f'<path d="{path}" fill="none" stroke="black" '
+           f'stroke-width="{linewidth}" stroke-linecap="round" '
+           f'stroke-linejoin="round"/></svg>')
+    if save_name is not None:
+        with open(save_name, "w") as file:
+            file.write(svg)
+    return svg
+
+
+def stroke_to_image(stroke, scale=4.0, linewidth=3.0, padding=20,
+                    supersample=2):
+    """
+    Rasterize `stroke` with Pillow. Lines are drawn `supersample` times
+    larger and downsampled for antialiasing (1 disables it).
+    Returns: grayscale PIL image
+    """
+    from PIL import Image, ImageDraw
+
+    segments, (width, height) = stroke_segments(stroke, scale * supersample,
+                                                padding * supersample)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    line_width = max(1, int(round(linewidth * supersample)))
+    for seg in segments:
+        draw.line(seg.ravel().tolist(), fill=0, width=line_width,
+                  joint="curve")
+    if supersample > 1:
+        image = image.reduce(supersample)
+    return image
+
+
+def stroke_to_png(stroke, save_name, scale=4.0, linewidth=3.0, padding=20,
+                  supersample=2):
+    stroke_to_image(stroke, scale, linewidth, padding,
+                    supersample).save(save_name)
+
+
+def stroke_to_frames(stroke, points_per_frame=5, scale=4.0, linewidth=3.0,
+                     padding=20, supersample=2):
+    """
+    Frames of the handwriting being drawn, `points_per_frame` new points
+    per frame. Each frame only draws its new points on a persistent
+    canvas, so the cost is linear in the length of `stroke`.
+    Yields: grayscale PIL images
+    """
+    from PIL import Image, ImageDraw
+
+    points, (width, height) = stroke_points(stroke, scale * supersample,
+                                            padding * supersample)
+    eos = stroke[:, 0]
+    canvas = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(canvas)
+    line_width = max(1, int(round(linewidth * supersample)))
+
+    for end in range(points_per_frame, len(points) + points_per_frame,
+                     points_per_frame):
+        # start from the last point of the previous frame to connect them
+        start = max(end - points_per_frame - 1, 0)
+        for seg in split_segments(points[start:end], eos, start):
+            draw.line(seg.ravel().tolist(), fill=0, width=line_width,
+                      joint="curve")
+        if supersample > 1:
+            yield canvas.reduce(supersample)
+        else:
+            yield canvas.copy()
+
+
+def stroke_to_animated_svg(stroke, save_name=None, fps=20,
+                           points_per_frame=5, scale=4.0, linewidth=3.0,
+                           padding=20):
+    """
+    Animated SVG, every pen down segment is a path revealed by animating
+    its CSS stroke-dashoffset at the pace of `fps` * `points_per_frame`
+    points per second.
+    Returns: the SVG document, also written to `save_name` if given
+    """
+    points, (width, height) = stroke_points(stroke, scale, padding)
+    points_per_second = fps * points_per_frame
+    cuts = np.where(stroke[:-1, 0] == 1)[0] + 1
+    paths = []
+    for start, seg in zip(np.concatenate(([0], cuts)),
+                          np.split(points, cuts)):
+        if len(seg) < 2:
+            continue
+        length = np.hypot(*np.diff(seg, axis=0).T).sum()
+        d = "M" + " L".join(f"{x:.1f},{y:.1f}" for x, y in seg)
+        paths.append(
+            f'<path d="{d}" style="stroke-dasharray:{length:.1f};'
+            f'stroke-dashoffset:{length:.1f};animation:draw '
+            f'{len(seg) / points_per_second:.3f}s linear '
+            f'{start / points_per_second:.3f}s forwards"/>')
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+           f'height="{height}" viewBox="0 0 {width} {height}">'
+           f'<style>@keyframes draw{{to{{stroke-dashoffset:0}}}}</style>'
+           f'<rect width="100%" height="100%" fill="white"/>'
+           f'<g fill="none" stroke="black" stroke-width="{linewidth}" '
+           f'stroke-linecap="round" stroke-linejoin="round">'
+           + "".join(paths) + '</g></svg>')
+    if save_name is not None:
+        with open(save_name, "w") as file:
+            file.write(svg)
+    return svg
+
+
+def save_animation(stroke, save_name, fps=20, points_per_frame=5):
+    """
+    Animated handwriting as .gif, .png (APNG) or .svg, chosen by the
+    extension of `save_name`.
+    """
+    ext = save_name[save_name.rfind("."):].lower()
+    if ext == ".svg":
+        stroke_to_animated_svg(stroke, save_name, fps, points_per_frame)
+        return
+    if ext not in (".gif", ".png"):
+        raise ValueError(f"Unsupported animation format: {ext}")
+
+    frames = list(stroke_to_frames(stroke, points_per_frame))
+    if not frames:
+        frames = [stroke_to_image(stroke)]
+    # Pillow's gif optimization rescans every frame, far slower than the
+    # drawing itself
+    frames[0].save(save_name, save_all=True, append_images=frames[1:],
+                   duration=int(1000 / fps), loop=0, optimize=False)
+
+
+RENDERERS = ("pillow", "matplotlib")
+
+
+def save_image(stroke, save_name, renderer="pillow"):
+    """
+    Save `stroke` as a .png with the `renderer` of RENDERERS.
+    """
+    if renderer == "pillow":
+        stroke_to_png(stroke, save_name)
+    elif renderer == "matplotlib":
+        from utils import plot_stroke
+        plot_stroke(stroke, save_name=save_name)
+    else:
+        raise ValueError(f"Unknown renderer: {renderer}")
@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk store of generated strokes and rendered
+    outputs.
+
+    Entries are keyed on everything that determines a seeded generation
+    (see `key`) and evicted least recently used first once the store
+    exceeds `max_bytes`. The access order survives restarts through the
+    file modification times. The public methods are thread-safe.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # serializes the index and eviction against concurrent requests
+        self.lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # file name -> size, least recently used first
+        self.entries = OrderedDict()
+        files = [entry for entry in os.scandir(cache_dir) if entry.is_file()]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+        self.size = sum(self.entries.values())
+
+    @staticmethod
+    def key(**fields):
+        """
+        Digest of the request fields, e.g. text, style, bias, seed and the
+        checkpoint digest.
+        """
+        data = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def lookup(self, name):
+        if name not in self.entries or not os.path.isfile(self.path(name)):
+            self.entries.pop(name, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(name)
+        os.utime(self.path(name))
+        self.hits += 1
+        return self.path(name)
+
+    def insert(self, name):
+        self.size -= self.entries.pop(name, 0)
+        self.entries[name] = os.path.getsize(self.path(name))
+        self.size += self.entries[name]
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            old_name, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            if os.path.isfile(self.path(old_name)):
+                os.remove(self.path(old_name))
+
+    def get_strokes(self, key):
+        """
+        Returns the cached stroke array of `key` or None.
+        """
+        with self.lock:
+            path = self.lookup(key + ".npy")
+            return None if path is None else np.load(path)
+
+    def put_strokes(self, key, strokes):
+        with self.lock:
+            np.save(self.path(key + ".npy"), strokes)
+            self.insert(key + ".npy")
+
+    def get_file(self, key, ext, dest):
+        """
+        Copy the cached `ext` rendering of `key` to `dest`.
+        Returns: `dest`, or None if it is not cached
+        """
+        with self.lock:
+            path = self.lookup(key + ext)
+            if path is None:
+                return None
+            shutil.copyfile(path, dest)
+            return dest
+
+    def put_file(self, key, ext, src):
+        with self.lock:
+            shutil.copyfile(src, self.path(key + ext))
+            self.insert(key + ext)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self.entries), "bytes": self.size}
@@ -0,0 +1,87 @@
+"""
+Export formats for generated stroke arrays [eos, x-offset, y-offset].
+
+    json   minified JSON list of points
+    npy    float32 .npy
+    npy16  float16 .npy
+    int16  quantized binary (.bin): a header then int16 [eos, dx, dy]
+           rows, the offsets are quantized positions so the rounding
+           error does not accumulate along the sequence
+"""
+
+import json
+import struct
+import numpy as np
+
+EXPORT_FORMATS = ("json", "npy", "npy16", "int16", "none")
+EXTENSIONS = {"json": ".json", "npy": ".npy", "npy16": ".npy",
+              "int16": ".bin"}
+
+INT16_MAGIC = b"STK1"
+INT16_HEADER = struct.Struct("<4sIf")  # magic, #points, scale
+INT16_MAX_SCALE = 100.0  # finest resolution, 0.01 offset units
+
+
+def quantize_strokes(stroke):
+    """
+    Returns:
+        int16 (seq_len, 3) array and the scale, offsets = rows / scale
+    """
+    positions = np.cumsum(stroke[:, 1:].astype(np.float64), axis=0)
+    max_offset = np.abs(stroke[:, 1:]).max() if len(stroke) else 0.
+    # room for the rounding of both positions of an offset
+    scale = min(INT16_MAX_SCALE, (2**15 - 2) / max(max_offset, 1e-6))
+    quantized = np.rint(positions * scale)
+    rows = np.empty((len(stroke), 3), dtype=np.int16)
+    rows[:, 0] = stroke[:, 0]
+    rows[:, 1:] = np.diff(quantized, axis=0, prepend=0)
+    return rows, scale
+
+
+def save_strokes(stroke, path_stem, export_format="json"):
+    """
+    Save `stroke` as `path_stem` + the extension of `export_format`.
+    Returns: the saved path, None for "none"
+    """
+    if export_format == "none":
+        return None
+    if export_format not in EXTENSIONS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    path = str(path_stem) + EXTENSIONS[export_format]
+
+    if export_format == "json":
+        with open(path, "w") as file:
+            json.dump(stroke.tolist(), file, separators=(",", ":"))
+    elif export_format == "npy":
+        np.save(path, stroke.astype(np.float32))
+    elif export_format == "npy16":
+        np.save(path, stroke.astype(np.float16))
+    else:
+        rows, scale = quantize_strokes(stroke)
+        with open(path, "wb") as file:
+            file.write(INT16_HEADER.pack(INT16_MAGIC, len(rows), scale))
+            file.write(rows.astype("<i2").tobytes())
+    return path
+
+
+def load_strokes(path):
+    """
+    Load any export format back as a float32 (seq_len, 3) array.
+    """
+    path = str(path)
+    if path.endswith(".json"):
+        with open(path) as file:
+            return np.array(json.load(file), dtype=np.float32).reshape(-1, 3)
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+
+    with open(path, "rb") as file:
+        magic, n_points, scale = INT16_HEADER.unpack(
+            file.read(INT16_HEADER.size))
+        if magic != INT16_MAGIC:
+            raise ValueError(f"Not an int16 stroke file: {path}")
+        rows = np.frombuffer(file.read(n_points * 6), dtype="<i2")
+    rows = rows.reshape(n_points, 3)
+    stroke = rows.astype(np.float32)
+    stroke[:, 1:] /= scale
+    return stroke
@@ -0,0 +1,71 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+def style_cache_dir(model_path):
+    """
+    Primed states are stored next to the checkpoint,
+    `model_x.pt` -> `model_x_styles/`
+    """
+    return os.path.splitext(str(model_path))[0] + "_styles"
+
+
+class StyleCache:
+    """
+    Post-priming (hidden, cell) states of the synthesis model per style.
+
+    Priming runs the network over hundreds of style strokes before a single
+    point is generated, but only depends on the weights and the style. The
+    states are kept in an in-memory LRU of `capacity` styles, backed by one
+    file per style in `cache_dir` (None keeps them in memory only).
+    """
+
+    def __init__(self, model_digest, cache_dir=None, capacity=8):
+        self.model_digest = model_digest
+        self.cache_dir = cache_dir
+        self.capacity = capacity
+        self.states = OrderedDict()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, style, text):
+        """
+        Digest of the weights, the raw style strokes and the style text.
+        """
+        digest = hashlib.sha1(self.model_digest.encode("utf-8"))
+        digest.update(np.ascontiguousarray(style, dtype=np.float32).tobytes())
+        digest.update(str(text).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, style, text, compute, device):
+        """
+        Cached state of `style` written by `text`, `compute()` primes the
+        model on a miss.
+        Returns:
+            (hidden, cell), each (n_layers, 1, hidden_size) on `device`
+        """
+        key = self.key(style, text)
+        if key in self.states:
+            self.states.move_to_end(key)
+            return self.states[key]
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, key + ".pt")
+        if path is not None and os.path.isfile(path):
+            state = tuple(torch.load(path, map_location=device))
+        else:
+            state = compute()
+            if path is not None:
+                try:
+                    torch.save(tuple(s.cpu() for s in state), path)
+                except OSError as e:
+                    print(f"[INFO] Could not save primed style: {e}")
+
+        self.states[key] = state
+        if len(self.states) > self.capacity:
+            self.states.popitem(last=False)
+        return state